@@ -0,0 +1,78 @@
+import argparse
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+from benchmarks.run_benchmarks import get_benchmarks_path
+from benchmarks.synthetic import generate_synthetic_dataset
+from mostra.catalog import StopCatalog
+from mostra.io import read_pred_data_csv
+from mostra.main import enrich_with_route_stop_name
+from mostra.preprocessing import aggregate_schedule_items
+
+import warnings
+warnings.filterwarnings('ignore')
+
+
+def measure_enrichment_memory(route_df: pd.DataFrame, catalog: StopCatalog) -> dict:
+    """
+    Peak memory allocated by enrich_with_route_stop_name for single route
+    compared with the size of the input route slice. Memory which is still
+    allocated after the call is the output table, the rest of the peak is
+    temporary copies made during enrichment
+    """
+    route_path_id = route_df['route_path_id'].iloc[0]
+    input_mb = route_df.memory_usage(deep=True).sum() / 1024 / 1024
+
+    tracemalloc.start()
+    df_vis, _ = enrich_with_route_stop_name(route_df, route_path_id, catalog)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del df_vis
+
+    peak_mb = peak / 1024 / 1024
+    temporary_mb = (peak - current) / 1024 / 1024
+    return {'route_path_id': route_path_id, 'rows': len(route_df),
+            'input_mb': round(input_mb, 2),
+            'output_mb': round(current / 1024 / 1024, 2),
+            'peak_allocated_mb': round(peak_mb, 2),
+            'temporary_mb': round(temporary_mb, 2),
+            'temporary_to_input': round(temporary_mb / input_mb, 2)}
+
+
+def run_enrichment_memory_benchmark(n_rows: int, seed: int = 0) -> dict:
+    """
+    Rus
+    Замер пикового объема памяти, выделяемой при добавлении названий
+    остановок к данным самого большого маршрута синтетического набора
+    данных. Память считается при помощи tracemalloc, поэтому в замер
+    попадают только выделения внутри enrich_with_route_stop_name
+
+    :param n_rows: number of rows in synthetic pred_data.csv
+    :param seed: seed for synthetic data generator
+    """
+    data_folder = Path(get_benchmarks_path(), 'data', f'{n_rows}_{seed}')
+    if not Path(data_folder, 'pred_data.csv').is_file():
+        print(f'Generate synthetic dataset with {n_rows} rows')
+        generate_synthetic_dataset(n_rows, data_folder, seed)
+
+    catalog = StopCatalog.from_csv(Path(data_folder, 'stop_from_repo.csv'))
+    preprocessed = aggregate_schedule_items(read_pred_data_csv(Path(data_folder, 'pred_data.csv')))
+    largest_route = preprocessed['route_path_id'].value_counts().index[0]
+    route_df = preprocessed[preprocessed['route_path_id'] == largest_route]
+    del preprocessed
+
+    result = measure_enrichment_memory(route_df, catalog)
+    print(f'{result["rows"]} rows in route slice: input {result["input_mb"]} MB, '
+          f'output {result["output_mb"]} MB, peak allocated {result["peak_allocated_mb"]} MB, '
+          f'temporary {result["temporary_mb"]} MB (x{result["temporary_to_input"]} of input)')
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Peak memory of stop names enrichment for single route')
+    parser.add_argument('--rows', type=int, default=10 ** 6,
+                        help='Number of rows in synthetic pred_data.csv')
+    args = parser.parse_args()
+    run_enrichment_memory_benchmark(args.rows)
@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import time
+from pathlib import Path
+
+from benchmarks.run_benchmarks import get_benchmarks_path
+from benchmarks.synthetic import generate_synthetic_dataset
+from mostra.instrumentation import get_peak_rss_mb
+from mostra.live import LiveArrivalEstimator, consume_events, iterate_queue, parse_event, tail_file
+
+import warnings
+warnings.filterwarnings('ignore')
+
+QUEUE_SIZE = 10000
+
+
+async def _feed_queue(queue: asyncio.Queue, events: list):
+    for event in events:
+        await queue.put(event)
+    await queue.put(None)
+
+
+async def _run_queue(estimator: LiveArrivalEstimator, events: list, on_arrival):
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    await asyncio.gather(_feed_queue(queue, events), consume_events(estimator, iterate_queue(queue), on_arrival))
+
+
+def run_live_benchmark(n_rows: int, seed: int = 0) -> list:
+    """
+    Rus
+    Замер пропускной способности (событий в секунду) потоковой оценки
+    времени прибытия на синтетическом журнале прогнозов для разных
+    источников событий: вызов напрямую, очередь asyncio и чтение файла.
+    Для каждого источника также выводится максимальное число открытых
+    кейсов в памяти и пиковое потребление памяти процессом
+
+    :param n_rows: number of rows in synthetic pred_data.csv
+    :param seed: seed for synthetic data generator
+    """
+    data_folder = Path(get_benchmarks_path(), 'data', f'{n_rows}_{seed}')
+    pred_data_path = Path(data_folder, 'pred_data.csv')
+    if not pred_data_path.is_file():
+        print(f'Generate synthetic dataset with {n_rows} rows')
+        generate_synthetic_dataset(n_rows, data_folder, seed)
+
+    with open(pred_data_path, 'r') as f:
+        events = [parse_event(line) for line in f]
+
+    results = []
+    for source in ['direct', 'queue', 'file']:
+        estimator = LiveArrivalEstimator()
+        max_open_cases = 0
+
+        def on_arrival(record: dict):
+            nonlocal max_open_cases
+            max_open_cases = max(max_open_cases, len(estimator))
+
+        start = time.perf_counter()
+        if source == 'direct':
+            for event in events:
+                if estimator.process_event(event) is not None:
+                    on_arrival(None)
+        elif source == 'queue':
+            asyncio.run(_run_queue(estimator, events, on_arrival))
+        else:
+            asyncio.run(consume_events(estimator, tail_file(pred_data_path, follow=False), on_arrival))
+        seconds = time.perf_counter() - start
+
+        results.append({'source': source, 'events': estimator.processed,
+                        'events_per_second': round(estimator.processed / seconds),
+                        'arrivals': estimator.emitted, 'evicted': estimator.evicted,
+                        'max_open_cases': max_open_cases,
+                        'peak_rss_mb': round(get_peak_rss_mb(), 1)})
+        print(f'{source}: {results[-1]["events_per_second"]} events/s, {estimator.emitted} arrivals, '
+              f'max {max_open_cases} open cases, peak RSS {results[-1]["peak_rss_mb"]} MB')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Throughput of streaming arrival estimation')
+    parser.add_argument('--rows', type=int, default=10 ** 6,
+                        help='Number of rows in synthetic pred_data.csv')
+    args = parser.parse_args()
+    run_live_benchmark(args.rows)
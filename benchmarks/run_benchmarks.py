@@ -0,0 +1,143 @@
+import argparse
+import datetime
+import json
+import platform
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import List
+
+from benchmarks.synthetic import generate_synthetic_dataset
+from mostra.arrival import calculate_arrival_time
+from mostra.catalog import StopCatalog
+from mostra.instrumentation import get_peak_rss_mb
+from mostra.io import read_pred_data_csv
+from mostra.main import enrich_with_route_stop_name
+from mostra.parallel import split_by_routes
+from mostra.paths import get_project_path
+from mostra.preprocessing import aggregate_schedule_items
+from mostra.stats import route_punctuality_report
+
+import warnings
+warnings.filterwarnings('ignore')
+
+DEFAULT_SIZES = [10 ** 5, 10 ** 6, 10 ** 7]
+
+
+def get_benchmarks_path() -> Path:
+    return Path(get_project_path(), 'benchmarks')
+
+
+def enrich_all_routes(df, catalog: StopCatalog):
+    for route_df in split_by_routes(df):
+        enrich_with_route_stop_name(route_df, route_df['route_path_id'].iloc[0], catalog)
+
+
+def benchmark_dataset(n_rows: int, data_folder: Path) -> List[dict]:
+    """
+    Run all stages for one dataset size. Should be called in a fresh process:
+    peak RSS is measured for the process, so each value is the peak from
+    the start of the run up to the end of the stage
+    """
+    pred_data_path = Path(data_folder, 'pred_data.csv')
+    stops_path = Path(data_folder, 'stop_from_repo.csv')
+    catalog = StopCatalog.from_csv(stops_path)
+
+    results = []
+
+    def measure(stage: str, func, *args):
+        start = time.perf_counter()
+        output = func(*args)
+        results.append({'stage': stage, 'rows': n_rows,
+                        'seconds': round(time.perf_counter() - start, 3),
+                        'peak_rss_mb': round(get_peak_rss_mb(), 1)})
+        print(f'{n_rows} rows - {stage}: {results[-1]["seconds"]} s, {results[-1]["peak_rss_mb"]} MB')
+        return output
+
+    df = measure('load_pred_data', read_pred_data_csv, pred_data_path)
+    preprocessed = measure('aggregate_schedule_items', aggregate_schedule_items, df)
+    del df
+    measure('enrich_with_route_stop_name', enrich_all_routes, preprocessed, catalog)
+    arrival = measure('calculate_arrival_time', calculate_arrival_time, preprocessed, catalog)
+    measure('route_punctuality_report', route_punctuality_report, arrival)
+    return results
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=get_project_path(), text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare_with_previous(history: list, run: dict):
+    """ Print relative change of time and memory against the previous run """
+    if len(history) < 1:
+        return
+    previous = {(result['stage'], result['rows']): result for result in history[-1]['results']}
+    print(f'Comparison with commit {history[-1]["commit"]}:')
+    for result in run['results']:
+        old_result = previous.get((result['stage'], result['rows']))
+        if old_result is None or old_result['seconds'] == 0:
+            continue
+        print(f'{result["rows"]} rows - {result["stage"]}: '
+              f'time x{result["seconds"] / old_result["seconds"]:.2f}, '
+              f'peak RSS x{result["peak_rss_mb"] / old_result["peak_rss_mb"]:.2f}')
+
+
+def run_benchmarks(sizes: List[int] = None, history_path: Path = None, seed: int = 0):
+    """
+    Rus
+    Запускает замеры производительности основных этапов обработки на
+    синтетических данных разного размера. Для каждого размера данные
+    генерируются один раз и сохраняются в папку benchmarks/data. Замеры
+    для каждого размера выполняются в отдельном процессе, чтобы пиковое
+    потребление памяти не зависело от предыдущих замеров. Результаты
+    дописываются в JSON файл с историей запусков
+
+    :param sizes: numbers of rows in pred_data.csv
+    :param history_path: path to JSON file with history. If None -
+    benchmarks/history.json is used
+    :param seed: seed for synthetic data generator
+    """
+    if sizes is None:
+        sizes = DEFAULT_SIZES
+    if history_path is None:
+        history_path = Path(get_benchmarks_path(), 'history.json')
+
+    results = []
+    for n_rows in sizes:
+        data_folder = Path(get_benchmarks_path(), 'data', f'{n_rows}_{seed}')
+        if not Path(data_folder, 'pred_data.csv').is_file():
+            print(f'Generate synthetic dataset with {n_rows} rows')
+            generate_synthetic_dataset(n_rows, data_folder, seed)
+
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            results.extend(executor.submit(benchmark_dataset, n_rows, data_folder).result())
+
+    history = []
+    if history_path.is_file():
+        with open(history_path, 'r') as f:
+            history = json.load(f)
+
+    run = {'commit': get_commit(),
+           'date': datetime.datetime.now().isoformat(timespec='seconds'),
+           'python': platform.python_version(),
+           'results': results}
+    compare_with_previous(history, run)
+    history.append(run)
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks on synthetic prediction logs')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Numbers of rows in synthetic pred_data.csv')
+    parser.add_argument('--history', type=Path, default=None,
+                        help='Path to JSON file with history of runs')
+    args = parser.parse_args()
+    run_benchmarks(args.rows, args.history)
@@ -0,0 +1,124 @@
+import uuid
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+import numpy as np
+
+from mostra.data_structure import COLUMN_NAMES
+from mostra.paths import create_folder
+
+import warnings
+warnings.filterwarnings('ignore')
+
+# 24 July 2022 06:00 (Moscow)
+START_TIME = 1658631600
+STOPS_PER_ROUTE = 25
+VEHICLES_PER_ROUTE = 8
+# Seconds between vehicle passes through the first stop of the route
+PASS_INTERVAL = 1800
+SECONDS_BETWEEN_STOPS = 120
+# Average number of rows for a single vehicle arrival at a stop
+ROWS_PER_ARRIVAL = 3.2
+
+
+def _generate_uuids(rng: np.random.Generator, size: int) -> np.ndarray:
+    return np.array([str(uuid.UUID(bytes=rng.bytes(16), version=4)) for _ in range(size)], dtype=object)
+
+
+def generate_stop_from_repo(n_routes: int, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Rus
+    Генерирует справочник остановок. Остановки выбираются из общего набора,
+    поэтому через одну остановку проходят несколько маршрутов
+    """
+    n_stops = max(int(n_routes * STOPS_PER_ROUTE * 0.6), STOPS_PER_ROUTE)
+    stops = pd.DataFrame({'stop_id': _generate_uuids(rng, n_stops),
+                          'name': [f'Остановка {i}' for i in range(n_stops)],
+                          'lat': rng.uniform(55.55, 55.9, n_stops),
+                          'lon': rng.uniform(37.35, 37.85, n_stops)})
+
+    route_ids = _generate_uuids(rng, n_routes)
+    route_stops = [rng.choice(n_stops, STOPS_PER_ROUTE, replace=False) for _ in range(n_routes)]
+    stop_from_repo = stops.iloc[np.concatenate(route_stops)].reset_index(drop=True)
+    stop_from_repo['route_path_id'] = np.repeat(route_ids, STOPS_PER_ROUTE)
+    is_bus = np.arange(n_routes) % 3 != 0
+    stop_from_repo['transport_type'] = np.repeat(np.where(is_bus, 'bus', 'tram'), STOPS_PER_ROUTE)
+    stop_from_repo['number'] = np.repeat(np.arange(1, n_routes + 1), STOPS_PER_ROUTE)
+    return stop_from_repo
+
+
+def generate_pred_data(stop_from_repo: pd.DataFrame, n_rows: int, rng: np.random.Generator) -> pd.DataFrame:
+    """
+    Rus
+    Генерирует журнал прогнозов: транспорт многократно проезжает по
+    маршруту, на каждую остановку приходится несколько запросов
+    пользователей с прогнозами по расписанию или по телеметрии и, как
+    правило, прогноз по телеметрии непосредственно перед прибытием.
+    Строки упорядочены по времени запроса, как в реальном журнале
+    """
+    route_ids = stop_from_repo['route_path_id'].unique()
+    n_routes = len(route_ids)
+    n_passes = int(np.ceil(n_rows / (n_routes * VEHICLES_PER_ROUTE * STOPS_PER_ROUTE * ROWS_PER_ARRIVAL)))
+
+    # Each arrival of vehicle at the stop
+    route, vehicle, passage, stop = np.indices((n_routes, VEHICLES_PER_ROUTE, n_passes, STOPS_PER_ROUTE))
+    route, vehicle, passage, stop = route.ravel(), vehicle.ravel(), passage.ravel(), stop.ravel()
+    arrival = START_TIME + passage * PASS_INTERVAL + vehicle * (PASS_INTERVAL // VEHICLES_PER_ROUTE) + \
+        stop * SECONDS_BETWEEN_STOPS + rng.integers(-60, 60, len(route))
+    stop_ids = stop_from_repo['stop_id'].to_numpy()[route * STOPS_PER_ROUTE + stop]
+    tm_ids = (route * VEHICLES_PER_ROUTE + vehicle + 1000).astype(np.int32)
+
+    # Users requests: from 1 to 4 per arrival
+    repeats = rng.integers(1, 5, len(route))
+    requests = np.repeat(np.arange(len(route)), repeats)
+    by_telemetry = rng.random(len(requests)) < 0.5
+    forecast_error = np.where(by_telemetry, rng.integers(-30, 30, len(requests)), rng.integers(-200, 200, len(requests)))
+    forecast_time = arrival[requests] + forecast_error
+    request_time = arrival[requests] - rng.integers(60, 900, len(requests))
+
+    # Telemetry right before arrival
+    near_arrival = np.flatnonzero(rng.random(len(route)) < 0.7)
+    requests = np.concatenate([requests, near_arrival])
+    by_telemetry = np.concatenate([by_telemetry, np.ones(len(near_arrival), dtype=bool)])
+    forecast_time = np.concatenate([forecast_time, arrival[near_arrival] + rng.integers(-5, 5, len(near_arrival))])
+    request_time = np.concatenate([request_time, arrival[near_arrival] - rng.integers(10, 110, len(near_arrival))])
+
+    # Take desired number of rows and order them as in log
+    selected = rng.choice(len(requests), min(n_rows, len(requests)), replace=False)
+    selected = selected[np.argsort(request_time[selected], kind='stable')]
+    requests = requests[selected]
+    df = pd.DataFrame({'id': np.arange(len(selected)),
+                       'stop_id': stop_ids[requests],
+                       'route_path_id': route_ids[route[requests]],
+                       'forecast_time': forecast_time[selected],
+                       'byTelemetry': by_telemetry[selected].astype(int),
+                       'tmId': tm_ids[requests],
+                       'routePathId': route[requests],
+                       'request_time': request_time[selected]})
+    return df[COLUMN_NAMES]
+
+
+def generate_synthetic_dataset(n_rows: int, folder: Union[Path, str], seed: int = 0):
+    """
+    Rus
+    Генерирует синтетические pred_data.csv (без заголовка, как исходный
+    датасет) и stop_from_repo.csv в заданной папке. Число маршрутов
+    растет вместе с числом строк (до 1000 маршрутов, как в Москве)
+
+    :param n_rows: number of rows in pred_data.csv
+    :param folder: folder to save files into
+    :param seed: seed for random generator
+    :return: paths to pred_data.csv and stop_from_repo.csv
+    """
+    folder = create_folder(folder)
+    rng = np.random.default_rng(seed)
+    n_routes = int(np.clip(n_rows // 20000, 5, 1000))
+
+    stop_from_repo = generate_stop_from_repo(n_routes, rng)
+    stops_path = Path(folder, 'stop_from_repo.csv')
+    stop_from_repo.to_csv(stops_path, index=False)
+
+    pred_data_path = Path(folder, 'pred_data.csv')
+    generate_pred_data(stop_from_repo, n_rows, rng).to_csv(pred_data_path, index=False, header=False)
+    return pred_data_path, stops_path
@@ -0,0 +1,19 @@
+from mostra.basemap import download_basemap
+
+import warnings
+warnings.filterwarnings('ignore')
+
+
+def download_tiles(zoom: int):
+    """
+    Rus
+    Загружает подложку OSM для Москвы в папку data/tiles. Скрипт нужно
+    запустить один раз на машине с доступом к сети - после этого карты в
+    slide_2 и slide_8 строятся без обращения к сети
+    """
+    basemap_path = download_basemap(zoom=zoom)
+    print(f'Basemap saved into {basemap_path}')
+
+
+if __name__ == '__main__':
+    download_tiles(zoom=12)
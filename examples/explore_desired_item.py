@@ -1,9 +1,6 @@
-from pathlib import Path
-
 import pandas as pd
 
-from mostra.data_structure import COLUMN_NAMES
-from mostra.paths import get_data_path
+from mostra.query import get_query_engine
 
 
 def show_desired_item(stop_id: str, route_path_id: str, tm_id: int = None):
@@ -12,13 +9,11 @@ def show_desired_item(stop_id: str, route_path_id: str, tm_id: int = None):
     Формирует таблицу для требуемого транспортного средства, маршрута (с учетом
     направления) и остановки. Запрос формируется для исходной таблицы с данными.
     Таким образом можно посмотреть на интересующие данные более пристально -
-    изучить странные артефакты и поискать закономерность "в ручном режиме"
+    изучить странные артефакты и поискать закономерность "в ручном режиме".
+    Таблица загружается и индексируется только при первом вызове, повторные
+    запросы выполняются бинарным поиском по индексу (см. mostra.query)
     """
-    df = pd.read_csv(Path(get_data_path(), 'pred_data.csv'), names=COLUMN_NAMES)
-    df = df[df['stop_id'] == stop_id]
-    df = df[df['route_path_id'] == route_path_id]
-    if tm_id is not None:
-        df = df[df['tmId'] == tm_id]
+    df = get_query_engine().query(route_path_id, stop_id, tm_id)
 
     # Add columns for convenient debug checking
     df['forecast_time_datetime'] = pd.to_datetime(df['forecast_time'], unit='s')
@@ -0,0 +1,36 @@
+from pathlib import Path
+
+import pandas as pd
+
+from mostra.accuracy import forecast_accuracy_report
+from mostra.paths import get_data_path
+
+import warnings
+warnings.filterwarnings('ignore')
+
+
+def calculate_and_save_forecast_accuracy():
+    """
+    Rus
+    Расчет точности прогнозного времени прибытия в зависимости от
+    заблаговременности прогноза, типа прогноза (расписание или телеметрия),
+    типа транспорта и времени суток. Фактическое время прибытия берется из
+    таблицы actual_vs_forecasted.csv (см. calculate_arrival_time и
+    slide_6_calculate_arrival_time.py), результат сохраняется в файл
+    forecast_accuracy.csv.
+
+    В таблице actual_vs_forecasted.csv есть только агрегированные прогнозы
+    по расписанию, поэтому byTelemetry для всех строк равен False. Для
+    оценки точности прогнозов по телеметрии можно передать в
+    forecast_accuracy_report результат assign_actual_arrival_time (он
+    использует другие пороги и не включает строки с tmId = 0)
+    """
+    df = pd.read_csv(Path(get_data_path(), 'actual_vs_forecasted.csv'))
+
+    report = forecast_accuracy_report(df)
+    report.to_csv(Path(get_data_path(), 'forecast_accuracy.csv'), index=False)
+    print(report)
+
+
+if __name__ == '__main__':
+    calculate_and_save_forecast_accuracy()
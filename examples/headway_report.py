@@ -0,0 +1,34 @@
+from pathlib import Path
+
+import pandas as pd
+
+from mostra.catalog import get_stop_catalog
+from mostra.headway import calculate_headways, route_headway_report
+from mostra.paths import get_data_path
+
+import warnings
+warnings.filterwarnings('ignore')
+
+
+def calculate_and_save_headways():
+    """
+    Rus
+    Расчет интервалов движения транспорта на остановках и сводки по
+    маршрутам (средний интервал, регулярность движения и доля сгонов).
+    Интервалы сохраняются в файл headways.csv, сводка - в headway_report.csv
+    """
+    actual = pd.read_csv(Path(get_data_path(), 'actual_vs_forecasted.csv'),
+                         usecols=['route_path_id', 'stop_id', 'tmId', 'forecast_time', 'arrival_time'],
+                         dtype={'route_path_id': 'category', 'stop_id': 'category'})
+    headways = calculate_headways(actual)
+    headways.to_csv(Path(get_data_path(), 'headways.csv'), index=False)
+
+    report = route_headway_report(headways)
+    catalog = get_stop_catalog()
+    report['route_name'] = [catalog.route_name(route_path_id) for route_path_id in report['route_path_id']]
+    report.to_csv(Path(get_data_path(), 'headway_report.csv'), index=False)
+    print(report.sort_values(by='bunching_ratio', ascending=False).head(10))
+
+
+if __name__ == '__main__':
+    calculate_and_save_headways()
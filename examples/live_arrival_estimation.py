@@ -0,0 +1,37 @@
+import asyncio
+import csv
+from pathlib import Path
+
+from mostra.live import LiveArrivalEstimator, consume_events, tail_file
+from mostra.paths import get_data_path
+
+import warnings
+warnings.filterwarnings('ignore')
+
+ARRIVAL_COLUMNS = ['route_path_id', 'stop_id', 'tmId', 'forecast_time', 'arrival_time',
+                   'request_time', 'scheduled_count']
+
+
+def estimate_arrival_time_online():
+    """
+    Rus
+    Оценка фактического времени прибытия транспорта в течение дня: скрипт
+    следит за дописываемым файлом pred_data.csv и сразу после появления
+    надежного прогноза по телеметрии дописывает запись о прибытии в файл
+    live_arrivals.csv
+    """
+    estimator = LiveArrivalEstimator()
+    with open(Path(get_data_path(), 'live_arrivals.csv'), 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=ARRIVAL_COLUMNS)
+        if f.tell() == 0:
+            writer.writeheader()
+
+        def on_arrival(record: dict):
+            writer.writerow(record)
+            f.flush()
+
+        asyncio.run(consume_events(estimator, tail_file(Path(get_data_path(), 'pred_data.csv')), on_arrival))
+
+
+if __name__ == '__main__':
+    estimate_arrival_time_online()
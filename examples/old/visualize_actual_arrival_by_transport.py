@@ -8,6 +8,7 @@ import seaborn as sns
 
 from tqdm import tqdm
 
+from mostra.catalog import get_stop_catalog
 from mostra.data_structure import HOUR_INTO_DAYTIME
 from mostra.paths import get_data_path
 
@@ -36,9 +37,7 @@ def visualize_actual_arrival_time_by_transport(per_daytime: bool = False):
     df_for_visualization = df_for_visualization.reset_index()
 
     # Enrich with additional data
-    stop_from_repo = pd.read_csv(Path(get_data_path(), 'stop_from_repo.csv'))
-    stop_from_repo = stop_from_repo[['route_path_id', 'transport_type', 'number']]
-    stop_from_repo = stop_from_repo.drop_duplicates()
+    stop_from_repo = get_stop_catalog().routes.reset_index()
 
     updated_transport_types = []
     # TODO vectorize
@@ -0,0 +1,20 @@
+from mostra.streaming import process_pred_data_by_routes
+
+import warnings
+warnings.filterwarnings('ignore')
+
+
+def process_large_dataset(memory_budget_mb: float, n_jobs: int = 1):
+    """
+    Rus
+    Потоковая обработка pred_data.csv, который не помещается в оперативную
+    память: агрегация данных расписания и расчет фактического времени
+    прибытия выполняются отдельно для каждого маршрута. Результатом являются
+    те же таблицы, что и после запуска slide_4_route_with_stops_preprocessed.py
+    и slide_6_calculate_arrival_time.py (но без визуализаций)
+    """
+    process_pred_data_by_routes(memory_budget_mb=memory_budget_mb, n_jobs=n_jobs)
+
+
+if __name__ == '__main__':
+    process_large_dataset(memory_budget_mb=512, n_jobs=-1)
@@ -0,0 +1,20 @@
+from mostra.query import PredDataQueryEngine
+from mostra.query_server import serve_queries
+
+import warnings
+warnings.filterwarnings('ignore')
+
+
+def start_query_server(port: int = 8765):
+    """
+    Rus
+    Загружает pred_data.csv, строит индекс и запускает локальный HTTP сервер
+    для запросов к журналу прогнозов. Пример запроса:
+        curl "http://127.0.0.1:8765/query?route_path_id=1d40a752-2894-40b1-aeea-3b3bf18f8d68&stop_id=fe3e2f59-78bf-4599-8f5b-5745a9c94e67&tm_id=55830"
+    """
+    engine = PredDataQueryEngine.from_csv()
+    serve_queries(engine, port=port)
+
+
+if __name__ == '__main__':
+    start_query_server()
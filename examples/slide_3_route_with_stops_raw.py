@@ -1,7 +1,6 @@
 from pathlib import Path
-import pandas as pd
 
-from mostra.data_structure import COLUMN_NAMES
+from mostra.io import load_pred_data
 from mostra.main import TransportDataExplorer
 from mostra.paths import get_data_path
 
@@ -23,9 +22,9 @@ def generate_raw_route_plots(new_path: str):
         - цвет: обозначает были ли прогнозные значения приезда транспорта
         получены при помощи телеметрии или это данные расписания.
     """
-    df = pd.read_csv(Path(get_data_path(), 'pred_data.csv'), names=COLUMN_NAMES)
+    df = load_pred_data()
 
-    explorer = TransportDataExplorer(df)
+    explorer = TransportDataExplorer(df, data_path=Path(get_data_path(), 'pred_data.csv'))
     explorer.prepare_plots_stops_per_route(new_path)
 
 
@@ -2,7 +2,10 @@ from pathlib import Path
 
 import pandas as pd
 
-from mostra.data_structure import COLUMN_NAMES
+from mostra.catalog import get_stop_catalog
+from mostra.ids import decode_id_columns, encode_id_columns
+from mostra.incremental import IncrementalPipeline
+from mostra.io import load_pred_data
 from mostra.main import TransportDataExplorer
 from mostra.paths import get_data_path
 from mostra.preprocessing import aggregate_schedule_items
@@ -11,7 +14,7 @@ import warnings
 warnings.filterwarnings('ignore')
 
 
-def preprocess_schedule_data_and_show():
+def preprocess_schedule_data_and_show(n_jobs: int = 1, incremental: bool = False):
     """
     Rus
     Скрипт сначала агрегирует прогнозные времена прибытия по расписанию по
@@ -23,18 +26,29 @@ def preprocess_schedule_data_and_show():
         - ось Y: предсказанное время повяления транспорта на остановке
         - цвет: обозначает были ли прогнозные значения приезда транспорта
         получены при помощи телеметрии или это данные расписания.
-    """
-    # Load data
-    df = pd.read_csv(Path(get_data_path(), 'pred_data.csv'), names=COLUMN_NAMES)
 
-    # Aggregate and save for further steps
-    final_df = aggregate_schedule_items(df)
-    final_df.to_csv(Path(get_data_path(), 'pred_data_preprocessed.csv'), index=False)
+    :param n_jobs: number of processes to process routes in parallel.
+    -1 means all available cores
+    :param incremental: if True - process only rows appended to pred_data.csv
+    since the previous launch (see IncrementalPipeline)
+    """
+    preprocessed_path = Path(get_data_path(), 'pred_data_preprocessed.csv')
+    if incremental:
+        IncrementalPipeline().refresh()
+        final_df = encode_id_columns(pd.read_csv(preprocessed_path))
+    else:
+        # Load data (identifiers are replaced with integer codes)
+        df = load_pred_data(encode_ids=True)
+
+        # Aggregate and save for further steps
+        final_df = aggregate_schedule_items(df, n_jobs=n_jobs)
+        decode_id_columns(final_df).to_csv(preprocessed_path, index=False)
 
     # And generate visualizations per routes
-    explorer = TransportDataExplorer(final_df)
+    explorer = TransportDataExplorer(final_df, n_jobs=n_jobs, data_path=preprocessed_path,
+                                     catalog=get_stop_catalog(encode_ids=True))
     explorer.prepare_plots_stops_per_route('./routes_preprocessed')
 
 
 if __name__ == '__main__':
-    preprocess_schedule_data_and_show()
+    preprocess_schedule_data_and_show(n_jobs=-1)
@@ -24,10 +24,10 @@ def create_transport_and_stops_plots(folder_to_save: Union[Path, str]):
         получены при помощи телеметрии или это данные расписания. Треугольник
         значит - телеметрия, кружок - данные расписания
     """
-    df = pd.read_csv(Path(get_data_path(), 'pred_data_preprocessed.csv'),
-                     parse_dates=['forecast_time_datetime', 'request_time_datetime'])
+    preprocessed_path = Path(get_data_path(), 'pred_data_preprocessed.csv')
+    df = pd.read_csv(preprocessed_path, parse_dates=['forecast_time_datetime', 'request_time_datetime'])
 
-    explorer = TransportDataExplorer(df)
+    explorer = TransportDataExplorer(df, data_path=preprocessed_path)
     explorer.prepare_plots_track_transport(folder_to_save)
 
 
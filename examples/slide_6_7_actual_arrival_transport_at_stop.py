@@ -7,10 +7,10 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-from tqdm import tqdm
-
-from mostra.data_structure import HOUR_INTO_DAYTIME
+from mostra.log import progress
 from mostra.paths import get_data_path, create_folder
+from mostra.stats import DAYTIME_COLUMN, DAYTIME_ORDER, DELAY_COLUMN, calculate_daytime, \
+    calculate_delay_minutes, route_punctuality_report
 
 import warnings
 warnings.filterwarnings('ignore')
@@ -24,18 +24,16 @@ def visualize_actual_arrival_time(folder_to_save: Union[Path, str] = '.'):
 
     folder_to_save = create_folder(folder_to_save)
 
-    route_path_ids = list(actual['route_path_id'].unique())
-    pbar = tqdm(route_path_ids, colour='blue')
-    for route_path_id in pbar:
-        pbar.set_description(f'Processing route path with id {route_path_id}')
-
-        stop_df = actual[actual['route_path_id'] == route_path_id]
-        stop_df = stop_df.sort_values('arrival_time')
+    # Statistics for all routes are calculated at once
+    report = route_punctuality_report(actual, by_daytime=True)
+    report.to_csv(Path(folder_to_save, 'punctuality_report.csv'), index=False)
 
-        stop_df['Отклонение от расписания, мин'] = stop_df['arrival_time'] - stop_df['forecast_time']
-        stop_df['Отклонение от расписания, мин'] = stop_df['Отклонение от расписания, мин'] / 60
+    actual[DELAY_COLUMN] = calculate_delay_minutes(actual)
+    actual[DAYTIME_COLUMN] = calculate_daytime(actual)
+    actual = actual.sort_values(by='forecast_time_datetime', kind='mergesort')
 
-        stop_df = stop_df.sort_values(by='forecast_time_datetime')
+    routes = actual.groupby('route_path_id', sort=False)
+    for route_path_id, stop_df in progress(routes, 'Plot actual arrival time', total=routes.ngroups):
         stop_df = stop_df.rename(columns={'arrival_time_datetime': 'Дата и время прибытия на остановку'})
 
         transport = stop_df["transport_type"].iloc[0]
@@ -67,15 +65,11 @@ def visualize_actual_arrival_time(folder_to_save: Union[Path, str] = '.'):
                     dpi=300, bbox_inches='tight')
         plt.close()
 
-        stop_df['Время суток'] = stop_df['Дата и время прибытия на остановку'].dt.hour
-        stop_df['Время суток'] = stop_df['Время суток'].replace(HOUR_INTO_DAYTIME)
-
         with sns.axes_style('darkgrid'):
             sns.catplot(data=stop_df,
                         x="Время суток", y="Отклонение от расписания, мин",
                         palette='crest', hue='Время суток',
-                        order=['утр. час пик', 'утро', 'день', 'веч. час пик', 'вечер', 'ночь'],
-                        hue_order=['утр. час пик', 'утро', 'день', 'веч. час пик', 'вечер', 'ночь'])
+                        order=DAYTIME_ORDER, hue_order=DAYTIME_ORDER)
             plt.savefig(Path(folder_to_save, f'{plot_name}_boxplot.png'),
                         dpi=300, bbox_inches='tight')
             plt.close()
@@ -0,0 +1,131 @@
+from typing import Optional, Sequence
+
+import pandas as pd
+import numpy as np
+
+from mostra.catalog import StopCatalog
+from mostra.data_structure import HOUR_INTO_DAYTIME
+from mostra.instrumentation import instrumented
+from mostra.stats import DAYTIME_COLUMN, DAYTIME_ORDER
+
+import warnings
+warnings.filterwarnings('ignore')
+
+# Edges of forecast horizon bins in minutes (the last bin is open)
+HORIZON_EDGES_MINUTES = [0, 2, 5, 10, 15, 20, 30, 45, 60]
+QUANTILES = [0.1, 0.5, 0.9]
+# Errors are accumulated into histogram with that resolution to calculate
+# quantiles. Larger errors are placed into the outer bins
+ERROR_BIN_SECONDS = 15
+MAX_ERROR_SECONDS = 60 * 60
+HORIZON_COLUMN = 'Заблаговременность, мин'
+
+
+@instrumented('accuracy')
+def forecast_accuracy_report(df: pd.DataFrame, catalog: Optional[StopCatalog] = None,
+                             horizon_edges: Sequence[float] = tuple(HORIZON_EDGES_MINUTES),
+                             quantiles: Sequence[float] = tuple(QUANTILES)) -> pd.DataFrame:
+    """
+    Rus
+    Точность прогнозного времени прибытия в зависимости от
+    заблаговременности прогноза (forecast_time - request_time). Строки
+    группируются по интервалу заблаговременности, типу прогноза
+    (byTelemetry), типу транспорта и времени суток (по времени прибытия, см.
+    HOUR_INTO_DAYTIME). Ошибка прогноза - forecast_time - arrival_time (если
+    она положительна, то транспорт приехал раньше прогноза). Для каждой
+    группы считается средняя абсолютная ошибка, смещение (средняя ошибка) и
+    квантили ошибки в минутах.
+
+    Все суммы считаются одним проходом при помощи np.bincount по общему коду
+    группы. Квантили определяются по гистограмме ошибок с шагом
+    ERROR_BIN_SECONDS секунд (точность квантилей - шаг гистограммы)
+
+    :param df: table with forecast_time, request_time, arrival_time,
+    byTelemetry and route_path_id (or transport_type) columns. For example,
+    output of assign_actual_arrival_time
+    :param catalog: catalog to define transport type by route_path_id. Not
+    used if df has transport_type column
+    :param horizon_edges: edges of horizon bins in minutes
+    :param quantiles: quantiles of error to calculate
+    """
+    forecast_time = df['forecast_time'].to_numpy(dtype=float)
+    error = forecast_time - df['arrival_time'].to_numpy(dtype=float)
+    horizon = (forecast_time - df['request_time'].to_numpy(dtype=float)) / 60
+
+    # Codes of each dimension
+    horizon_edges = np.asarray(horizon_edges, dtype=float)
+    horizon_codes = np.searchsorted(horizon_edges, horizon, side='right') - 1
+    telemetry_codes = df['byTelemetry'].to_numpy().astype(np.int64)
+    transport_codes, transport_types = pd.factorize(_get_transport_types(df, catalog))
+    daytime_codes = _get_daytime_codes(df['arrival_time'].to_numpy(dtype=float))
+
+    # Rows with negative horizon or without known transport type are skipped
+    is_valid = (horizon_codes >= 0) & ~np.isnan(horizon) & (transport_codes >= 0) & ~np.isnan(error)
+    shape = (len(horizon_edges), 2, len(transport_types), len(DAYTIME_ORDER))
+    group_codes = np.ravel_multi_index((horizon_codes[is_valid], telemetry_codes[is_valid],
+                                        transport_codes[is_valid], daytime_codes[is_valid]), shape)
+    error = error[is_valid]
+    n_groups = int(np.prod(shape))
+
+    counts = np.bincount(group_codes, minlength=n_groups)
+    error_sums = np.bincount(group_codes, weights=error, minlength=n_groups)
+    abs_error_sums = np.bincount(group_codes, weights=np.abs(error), minlength=n_groups)
+    error_quantiles = _histogram_quantiles(group_codes, error, n_groups, counts, quantiles)
+
+    has_rows = np.flatnonzero(counts > 0)
+    horizon_ids, telemetry_ids, transport_ids, daytime_ids = np.unravel_index(has_rows, shape)
+    report = pd.DataFrame({HORIZON_COLUMN: _get_horizon_labels(horizon_edges)[horizon_ids],
+                           'byTelemetry': telemetry_ids.astype(bool),
+                           'transport_type': np.asarray(transport_types)[transport_ids],
+                           DAYTIME_COLUMN: np.array(DAYTIME_ORDER)[daytime_ids],
+                           'rows': counts[has_rows],
+                           'mae_minutes': abs_error_sums[has_rows] / counts[has_rows] / 60,
+                           'bias_minutes': error_sums[has_rows] / counts[has_rows] / 60})
+    for quantile, values in zip(quantiles, error_quantiles):
+        report[f'q{round(quantile * 100)}_minutes'] = values[has_rows] / 60
+    return report
+
+
+def _get_transport_types(df: pd.DataFrame, catalog: Optional[StopCatalog]) -> pd.Series:
+    if 'transport_type' in df.columns:
+        return df['transport_type']
+    if catalog is None:
+        raise ValueError('transport_type column or catalog is required')
+    # Map only unique routes and then expand by codes
+    route_codes, routes = pd.factorize(df['route_path_id'])
+    route_types = catalog.routes['transport_type'].reindex(np.asarray(routes)).to_numpy()
+    return pd.Series(np.where(route_codes >= 0, route_types[route_codes], None), index=df.index)
+
+
+def _get_daytime_codes(arrival_time: np.ndarray) -> np.ndarray:
+    """ Position of the period of the day (see HOUR_INTO_DAYTIME) in DAYTIME_ORDER """
+    hour_codes = np.array([DAYTIME_ORDER.index(HOUR_INTO_DAYTIME[hour]) for hour in range(24)])
+    hours = np.nan_to_num(arrival_time // 3600 % 24).astype(np.int64)
+    return hour_codes[hours]
+
+
+def _get_horizon_labels(horizon_edges: np.ndarray) -> np.ndarray:
+    labels = [f'{start:g}-{end:g}' for start, end in zip(horizon_edges[:-1], horizon_edges[1:])]
+    labels.append(f'{horizon_edges[-1]:g}+')
+    return np.array(labels)
+
+
+def _histogram_quantiles(group_codes: np.ndarray, error: np.ndarray, n_groups: int,
+                         counts: np.ndarray, quantiles: Sequence[float]) -> list:
+    """
+    Quantiles of error for each group by histogram with ERROR_BIN_SECONDS
+    step. Returns centers of the bins which contain the quantiles
+    """
+    n_bins = 2 * MAX_ERROR_SECONDS // ERROR_BIN_SECONDS
+    error_bins = np.clip((error + MAX_ERROR_SECONDS) // ERROR_BIN_SECONDS, 0, n_bins - 1).astype(np.int64)
+    histogram = np.bincount(group_codes * n_bins + error_bins, minlength=n_groups * n_bins)
+    cumulative = np.cumsum(histogram.reshape(n_groups, n_bins), axis=1)
+
+    bin_centers = -MAX_ERROR_SECONDS + (np.arange(n_bins) + 0.5) * ERROR_BIN_SECONDS
+    values = []
+    for quantile in quantiles:
+        # First bin where cumulative count reaches the quantile rank
+        rank = np.maximum(np.ceil(quantile * counts), 1)
+        bin_ids = (cumulative < rank[:, None]).sum(axis=1)
+        values.append(np.where(counts > 0, bin_centers[np.minimum(bin_ids, n_bins - 1)], np.nan))
+    return values
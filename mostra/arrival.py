@@ -0,0 +1,272 @@
+from typing import Optional
+
+import pandas as pd
+import numpy as np
+
+from mostra.catalog import StopCatalog
+from mostra.data_structure import MIN_FORECAST_HORIZON_SECONDS
+from mostra.instrumentation import instrumented, track_stage
+from mostra.log import get_logger
+from mostra.main import enrich_with_route_stop_name
+from mostra.parallel import apply_per_route
+from mostra.preprocessing import CASE_KEYS, label_schedule_cases
+
+import warnings
+warnings.filterwarnings('ignore')
+
+logger = get_logger(__name__)
+
+BELONG_CASE_SECONDS_TEL_THRESHOLD = 10 * 60
+# Max distance between telemetry forecast and the nearest scheduled item of case
+CASE_SECONDS_TEL_THRESHOLD = 20 * 60
+
+
+def calculate_arrival_time(df: pd.DataFrame, catalog: StopCatalog,
+                           n_jobs: int = 1, show_progress: bool = True) -> pd.DataFrame:
+    """
+    Rus
+    Расчет фактического времени прибытия для каждой пары
+    "остановка - транспорт id" по предобработанной таблице (см.
+    aggregate_schedule_items)
+
+    :param df: preprocessed table with aggregated scheduled items
+    :param catalog: catalog of stops and routes
+    :param n_jobs: number of processes to add stops names to routes in
+    parallel. -1 means all available cores
+    :param show_progress: show progress bar. Should be False if the function
+    is called for part of the data inside other stage
+    """
+    with track_stage('enrich', rows_in=len(df)) as record:
+        df_vis = apply_per_route(enrich_route, df, n_jobs, show_progress, catalog=catalog)
+        record['rows_out'] = len(df_vis)
+    if len(df_vis) < 1:
+        return df_vis
+    if 'id' in list(df_vis.columns):
+        df_vis = df_vis.drop(columns=['id'])
+
+    final_df = match_telemetry_to_schedule(df_vis)
+    final_df = final_df.dropna()
+
+    final_df['arrival_time_datetime'] = pd.to_datetime(final_df['arrival_time'], unit='s')
+    return final_df
+
+
+def enrich_route(route_path_df: pd.DataFrame, catalog: StopCatalog) -> Optional[pd.DataFrame]:
+    """ Add stops and route names to the table of single route. Unknown routes are skipped """
+    route_path_id = route_path_df['route_path_id'].iloc[0]
+    logger.debug(f'Process path {route_path_id}')
+
+    try:
+        df_vis, _ = enrich_with_route_stop_name(route_path_df, route_path_id, catalog)
+    except Exception as ex:
+        logger.debug(f'Skip {route_path_id} due to {ex!r}')
+        return None
+    return df_vis
+
+
+@instrumented('arrival_matching')
+def match_telemetry_to_schedule(df: pd.DataFrame,
+                                threshold: float = BELONG_CASE_SECONDS_TEL_THRESHOLD) -> pd.DataFrame:
+    """
+    Rus
+    Сопоставляет каждой записи расписания данные телеметрии того же
+    транспорта на той же остановке. Время прибытия (arrival_time) - это
+    самое раннее "надежное" прогнозное время по телеметрии (запрос сделан
+    не более чем за MIN_FORECAST_HORIZON_SECONDS до прибытия), которое
+    отличается от времени по расписанию меньше чем на threshold секунд.
+    Если такого нет - arrival_time равен NaN.
+
+    Сопоставление выполняется одним проходом по всей таблице при помощи
+    merge_asof: для каждой записи расписания ищется первая запись телеметрии,
+    прогнозное время которой строго больше (forecast_time - threshold)
+
+    :param df: table with scheduled and telemetry data
+    :param threshold: max allowed difference between scheduled time and
+    telemetry forecast in seconds
+
+    :return: scheduled data with arrival_time column
+    """
+    keys = ['route_path_id', 'tmId', 'stop_id']
+    tel_data = df[df['byTelemetry'] == 1]
+    scheduled_data = df[df['byTelemetry'] == 0]
+
+    # Remain only "reliable" data
+    horizon = np.abs(tel_data['forecast_time'] - tel_data['request_time'])
+    tel_data = tel_data[horizon <= MIN_FORECAST_HORIZON_SECONDS].dropna()
+    tel_data = tel_data[keys + ['forecast_time']].rename(columns={'forecast_time': 'arrival_time'})
+    tel_data['arrival_time'] = tel_data['arrival_time'].astype(float)
+    tel_data = tel_data.sort_values(by='arrival_time')
+
+    scheduled_data['window_start'] = scheduled_data['forecast_time'].astype(float) - threshold
+    scheduled_data = scheduled_data.sort_values(by='window_start')
+
+    matched = pd.merge_asof(scheduled_data, tel_data, left_on='window_start',
+                            right_on='arrival_time', by=keys,
+                            direction='forward', allow_exact_matches=False)
+    is_far = matched['arrival_time'] >= matched['forecast_time'] + threshold
+    matched.loc[is_far, 'arrival_time'] = np.nan
+
+    matched = matched.drop(columns=['window_start'])
+    matched = matched.sort_values(by=keys + ['forecast_time'], kind='mergesort')
+    return matched.reset_index(drop=True)
+
+
+def assign_telemetry_cases(scheduled_groups: np.ndarray, scheduled_times: np.ndarray,
+                           scheduled_cases: np.ndarray, tel_groups: np.ndarray,
+                           tel_times: np.ndarray, threshold: float) -> np.ndarray:
+    """
+    Rus
+    Назначает записям телеметрии кейс ближайшей по времени записи
+    расписания той же группы (тройки "маршрут - остановка - транспорт").
+    Для каждой записи телеметрии бинарным поиском находятся соседние записи
+    расписания слева и справа, выбирается ближайшая из них (при равенстве -
+    левая). Если расстояние до нее не меньше threshold, то кейс не
+    назначается (NaN)
+
+    :param scheduled_groups: group codes of scheduled items
+    :param scheduled_times: forecast times of scheduled items. Items must be
+    sorted by group code and then by time
+    :param scheduled_cases: case labels of scheduled items
+    :param tel_groups: group codes of telemetry items
+    :param tel_times: forecast times of telemetry items
+    :param threshold: max allowed distance between telemetry and scheduled
+    forecast times in seconds
+    """
+    tel_cases = np.full(len(tel_times), np.nan)
+    if len(scheduled_times) < 1 or len(tel_times) < 1:
+        return tel_cases
+
+    # Groups are placed far from each other on the common time axis, so
+    # single binary search works for all groups at once
+    min_time = min(scheduled_times.min(), tel_times.min())
+    span = max(scheduled_times.max(), tel_times.max()) - min_time + 1
+    scheduled_axis = scheduled_groups * span + (scheduled_times - min_time)
+    tel_axis = tel_groups * span + (tel_times - min_time)
+    right_ids = np.searchsorted(scheduled_axis, tel_axis, side='left')
+    left_ids = right_ids - 1
+
+    last_id = len(scheduled_times) - 1
+    left_ids_clipped = np.clip(left_ids, 0, last_id)
+    right_ids_clipped = np.clip(right_ids, 0, last_id)
+    has_left = (left_ids >= 0) & (scheduled_groups[left_ids_clipped] == tel_groups)
+    has_right = (right_ids <= last_id) & (scheduled_groups[right_ids_clipped] == tel_groups)
+
+    left_distance = np.where(has_left, tel_times - scheduled_times[left_ids_clipped], np.inf)
+    right_distance = np.where(has_right, scheduled_times[right_ids_clipped] - tel_times, np.inf)
+
+    is_left_nearest = left_distance <= right_distance
+    nearest_ids = np.where(is_left_nearest, left_ids_clipped, right_ids_clipped)
+    nearest_distance = np.where(is_left_nearest, left_distance, right_distance)
+
+    is_assigned = nearest_distance < threshold
+    tel_cases[is_assigned] = scheduled_cases[nearest_ids[is_assigned]]
+    return tel_cases
+
+
+def enrich_with_cases_and_horizon(df: pd.DataFrame,
+                                  threshold: float = CASE_SECONDS_TEL_THRESHOLD) -> pd.DataFrame:
+    """
+    Rus
+    Назначает каждой записи в таблице идентификатор кейса и рассчитывает
+    заблаговременность прогноза (время ожидания до приезда автобуса).
+    Кейсы выделяются по данным расписания отдельно для каждой тройки
+    "маршрут - остановка - транспорт" (нумерация с нуля внутри тройки), а
+    записи телеметрии присоединяются к кейсу ближайшей записи расписания.
+    Записи телеметрии без кейса удаляются
+
+    :param df: table with scheduled and telemetry data
+    :param threshold: max allowed distance between telemetry and scheduled
+    forecast times in seconds
+    """
+    group_codes = df.groupby(CASE_KEYS, sort=False, observed=True).ngroup()
+    df = df.assign(group_code=group_codes)
+
+    scheduled_df = df[df['byTelemetry'] == 0]
+    scheduled_df = scheduled_df.sort_values(by=['group_code', 'forecast_time'], kind='mergesort')
+    cases = label_schedule_cases(scheduled_df)
+    # Cases are enumerated from zero for each triple
+    scheduled_df['case'] = cases - cases.groupby(scheduled_df['group_code']).transform('min')
+
+    tel_df = df[df['byTelemetry'] == 1]
+    tel_df['case'] = assign_telemetry_cases(scheduled_df['group_code'].to_numpy(),
+                                            scheduled_df['forecast_time'].to_numpy(dtype=float),
+                                            scheduled_df['case'].to_numpy(),
+                                            tel_df['group_code'].to_numpy(),
+                                            tel_df['forecast_time'].to_numpy(dtype=float),
+                                            threshold)
+
+    df = pd.concat([scheduled_df, tel_df]).drop(columns=['group_code'])
+    df = df.sort_values(by=CASE_KEYS + ['forecast_time', 'request_time'], kind='mergesort')
+
+    # Remove un appropriate telemetry observations
+    df = df.dropna()
+    df['forecast_horizon'] = df['forecast_time'] - df['request_time']
+    return df
+
+
+@instrumented('arrival_matching')
+def assign_actual_arrival_time(df: pd.DataFrame, stop_coordinates: pd.DataFrame,
+                               threshold: float = CASE_SECONDS_TEL_THRESHOLD) -> pd.DataFrame:
+    """
+    Rus
+    На основании исходной таблицы для пар "транспорт - остановка"
+    используются телеметрические данные, чтобы примерно оценить фактическое
+    время прибытия транспортного средства на остановку. Все пары
+    обрабатываются одновременно при помощи групповых операций.
+
+    Сначала выделяются кейсы: кейс - это когда ты стоишь на остановке и смотришь
+    в приложении когда следующий автобус приедет. Смотреть можешь несколько раз
+    подряд (будет несколько request_time), при этом каждый раз будет получать
+    разное прогнозное время (будет несколько forecast_time). Но автобус ждёшь
+    один и тот же, - и когда он приезжает на остановку - кейс закрывается.
+
+    Для каждого кейса:
+        - кейс пропускается, если есть запросы в одно и то же время с
+        разными прогнозами (коллизия)
+        - ищется запись телеметрии с минимальной заблаговременностью. Если
+        она меньше MIN_FORECAST_HORIZON_SECONDS, то ее прогнозное время
+        считается фактическим временем прибытия для всех остальных записей
+        кейса. Если таких записей несколько - берется первая
+
+    :param df: raw table (see COLUMN_NAMES)
+    :param stop_coordinates: table with stop_id, lat and lon columns
+    :param threshold: max allowed distance between telemetry and scheduled
+    forecast times in seconds to include telemetry into case
+
+    :return: table with case and arrival_time columns
+    """
+    # Skip non reliable data (we don't know exactly the calculation
+    # algorithm for rows with label)
+    df = df[df['tmId'] != 0]
+    df = df.merge(stop_coordinates, on='stop_id')
+    df = df.drop(columns=['id']).drop_duplicates()
+
+    # Only triples with both telemetry and scheduled data can be used
+    data_types = df.groupby(CASE_KEYS, sort=False, observed=True)['byTelemetry'].transform('nunique')
+    df = df[data_types == 2]
+
+    # Define cases and forecast horizon (in seconds)
+    df = enrich_with_cases_and_horizon(df, threshold)
+    case_keys = CASE_KEYS + ['case']
+
+    # Collision when we have requests in the same time and got different
+    # forecasted times
+    grouped = df.groupby(case_keys, sort=False, observed=True)
+    number_of_rows = grouped['request_time'].transform('size')
+    number_of_requests = grouped['request_time'].transform('nunique')
+    number_of_forecasts = grouped['forecast_time'].transform('nunique')
+    is_collision = (number_of_requests != number_of_rows) & (number_of_forecasts > number_of_requests)
+
+    # Telemetry with minimal forecast horizon defines arrival time of the case
+    tel_horizon = df['forecast_horizon'].where(df['byTelemetry'] == 1)
+    min_horizon = tel_horizon.groupby([df[key] for key in case_keys], sort=False,
+                                      observed=True).transform('min')
+    arrival_time = df['forecast_time'].where(tel_horizon == min_horizon)
+    df['arrival_time'] = arrival_time.groupby([df[key] for key in case_keys], sort=False,
+                                              observed=True).transform('first')
+
+    is_estimated = ~is_collision & (min_horizon < MIN_FORECAST_HORIZON_SECONDS)
+    # Rows which were used for arrival time estimation are excluded
+    df = df[is_estimated & (df['forecast_horizon'] != min_horizon)]
+    df = df.dropna()
+    return df.drop(columns=['forecast_horizon'])
@@ -0,0 +1,81 @@
+from pathlib import Path
+from typing import Union
+
+import contextily as cx
+
+from mostra.paths import create_folder, get_data_path
+
+import warnings
+warnings.filterwarnings('ignore')
+
+# Moscow extent in EPSG:3857 (west, south, east, north) which is used in maps
+MOSCOW_EXTENT = (4.16 * 1e6, 7.49 * 1e6, 4.22 * 1e6, 7.54 * 1e6)
+BASEMAP_ZOOM = 12
+# Color of the land on OSM maps - used when there are no tiles on disk
+BACKGROUND_COLOR = '#F2EFE9'
+
+
+def get_tiles_path() -> Path:
+    """ Return path for folder with basemap tiles """
+    return Path(get_data_path(), 'tiles')
+
+
+def get_basemap_path(zoom: int = BASEMAP_ZOOM, folder: Union[Path, str] = None) -> Path:
+    """ Return path to the raster with Moscow basemap for desired zoom level """
+    if folder is None:
+        folder = get_tiles_path()
+    return Path(folder, f'moscow_{zoom}.tif')
+
+
+def download_basemap(zoom: int = BASEMAP_ZOOM,
+                     extent: tuple = MOSCOW_EXTENT,
+                     folder: Union[Path, str] = None,
+                     source=None) -> Path:
+    """
+    Rus
+    Загружает тайлы подложки для заданной области и сохраняет их на диск в
+    виде одного растра (GeoTIFF). Загрузка выполняется один раз на машине с
+    доступом к сети, после чего карты строятся без обращения к сети (см.
+    add_cached_basemap). Загруженные тайлы также кэшируются в папке cache
+
+    :param zoom: zoom level of tiles
+    :param extent: west, south, east and north bounds in EPSG:3857
+    :param folder: folder to save raster into. If None - data/tiles is used
+    :param source: tiles provider. If None - OpenStreetMap Mapnik is used
+    """
+    if folder is None:
+        folder = get_tiles_path()
+    folder = create_folder(folder)
+    if source is None:
+        source = cx.providers.OpenStreetMap.Mapnik
+    cx.set_cache_dir(str(create_folder(Path(folder, 'cache'))))
+
+    basemap_path = get_basemap_path(zoom, folder)
+    west, south, east, north = extent
+    cx.bounds2raster(west, south, east, north, str(basemap_path),
+                     zoom=zoom, source=source, ll=False)
+    return basemap_path
+
+
+def add_cached_basemap(ax, zoom: int = BASEMAP_ZOOM, folder: Union[Path, str] = None, **kwargs) -> bool:
+    """
+    Rus
+    Добавляет подложку на карту из растра, сохраненного на диск функцией
+    download_basemap. Если растра нет, то вместо подложки используется
+    однотонный фон, поэтому построение карты никогда не обращается к сети.
+    Координаты на карте должны быть в EPSG:3857
+
+    :param ax: matplotlib axes with map
+    :param zoom: zoom level of the saved raster
+    :param folder: folder with rasters. If None - data/tiles is used
+    :param kwargs: additional parameters for contextily add_basemap
+    (reset_extent for example)
+    :return: True if basemap was added and False if plain background was used
+    """
+    basemap_path = get_basemap_path(zoom, folder)
+    if not basemap_path.is_file():
+        ax.set_facecolor(BACKGROUND_COLOR)
+        return False
+
+    cx.add_basemap(ax, source=str(basemap_path), **kwargs)
+    return True
@@ -0,0 +1,81 @@
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+from mostra.ids import encode_id_columns
+from mostra.paths import get_data_path
+
+import warnings
+warnings.filterwarnings('ignore')
+
+TRANSPORT_TYPE_NAMES = {'bus': 'Автобус', 'tram': 'Трамвай'}
+
+
+class StopCatalog:
+    """
+    Rus
+    Справочник остановок и маршрутов, построенный по таблице stop_from_repo.csv.
+    Таблица читается один раз, после чего для поиска используются индексы:
+        - stop_id -> название и координаты остановки
+        - route_path_id -> тип транспорта и номер маршрута
+        - route_path_id -> упорядоченный список остановок (в порядке
+        следования в исходной таблице)
+
+    :param stop_from_repo: table with stop_id, name, lat, lon, route_path_id,
+    transport_type and number columns
+    """
+
+    def __init__(self, stop_from_repo: pd.DataFrame):
+        stops = stop_from_repo[['stop_id', 'name', 'lat', 'lon']]
+        self.stops = stops.drop_duplicates(subset='stop_id').set_index('stop_id')
+
+        routes = stop_from_repo[['route_path_id', 'transport_type', 'number']]
+        self.routes = routes.drop_duplicates(subset='route_path_id').set_index('route_path_id')
+
+        self._route_stops_df = stop_from_repo[['route_path_id', 'stop_id']].drop_duplicates()
+        self._route_stops = {route_path_id: list(route_df['stop_id'])
+                             for route_path_id, route_df in self._route_stops_df.groupby('route_path_id', sort=False)}
+
+    @classmethod
+    def from_csv(cls, csv_path: Union[Path, str] = None, encode_ids: bool = False):
+        """
+        Load catalog from csv file. If path is None - stop_from_repo.csv from
+        data folder is used. If encode_ids is True - stop_id and route_path_id
+        are replaced with int32 codes (see mostra.ids)
+        """
+        if csv_path is None:
+            csv_path = Path(get_data_path(), 'stop_from_repo.csv')
+        stop_from_repo = pd.read_csv(csv_path)
+        if encode_ids:
+            stop_from_repo = encode_id_columns(stop_from_repo)
+        return cls(stop_from_repo)
+
+    def stop_name(self, stop_id) -> str:
+        """ Return name of the stop. Raise KeyError if there is no such stop """
+        return self.stops.at[stop_id, 'name']
+
+    def route_info(self, route_path_id) -> tuple:
+        """ Return transport type and number of the route. Raise KeyError if there is no such route """
+        route = self.routes.loc[route_path_id]
+        return route['transport_type'], route['number']
+
+    def route_name(self, route_path_id) -> str:
+        """ Return human readable route name, for example "Автобус 664" """
+        transport_type, number = self.route_info(route_path_id)
+        return f'{TRANSPORT_TYPE_NAMES.get(transport_type, transport_type)} {number}'
+
+    def route_stops(self, route_path_id) -> list:
+        """ Return ordered list of stop_id for the route (empty list for unknown route) """
+        return self._route_stops.get(route_path_id, [])
+
+    def route_stops_table(self) -> pd.DataFrame:
+        """ Return table with route_path_id, stop_id, lat and lon columns for joins """
+        return self._route_stops_df.merge(self.stops[['lat', 'lon']], left_on='stop_id', right_index=True)
+
+
+@lru_cache(maxsize=None)
+def get_stop_catalog(csv_path: Union[Path, str] = None, encode_ids: bool = False) -> StopCatalog:
+    """ Return catalog of stops. The file is read only once per process """
+    return StopCatalog.from_csv(csv_path, encode_ids)
@@ -0,0 +1,101 @@
+from typing import List, Tuple
+
+import pandas as pd
+
+from geopandas import GeoDataFrame
+
+from mostra.catalog import StopCatalog
+from mostra.convert import prepare_points_layer
+from mostra.spatial import DEFAULT_RADIUS_METERS, StopSpatialIndex
+
+import warnings
+warnings.filterwarnings('ignore')
+
+PUNCTUALITY_COLUMNS = ['Доля опозданий', 'Доля прибытий по расписанию',
+                       'Среднее время опозданий, мин']
+
+
+def prepare_route_stops_layer(report: pd.DataFrame, catalog: StopCatalog,
+                              epsg_code: int = 3857) -> GeoDataFrame:
+    """
+    Rus
+    Присоединяет к каждой строке отчета по маршрутам все остановки маршрута
+    с координатами из справочника. Маршруты, которых нет в справочнике,
+    пропускаются. Результат - слой точек (по одной точке на каждую пару
+    "маршрут - остановка") в заданной системе координат
+
+    :param report: table with route_path_id column and route statistics
+    :param catalog: catalog of stops and routes
+    :param epsg_code: code for CRS of the output layer
+    """
+    paths = report.merge(catalog.route_stops_table(), on='route_path_id')
+    paths = prepare_points_layer(paths)
+    paths = paths.drop(columns=['lat', 'lon'])
+    return paths.to_crs(epsg_code)
+
+
+def aggregate_by_stops(paths: GeoDataFrame, columns: List[str] = None) -> GeoDataFrame:
+    """
+    Rus
+    Усредняет статистики маршрутов, проходящих через остановку
+
+    :param paths: layer with stop_id column (see prepare_route_stops_layer)
+    :param columns: names of columns to average. If None - PUNCTUALITY_COLUMNS
+    are used
+    """
+    if columns is None:
+        columns = PUNCTUALITY_COLUMNS
+    aggregation = {column: 'mean' for column in columns}
+    aggregation['geometry'] = 'first'
+
+    stops = paths.groupby('stop_id').agg(aggregation)
+    stops = stops.reset_index()
+    return GeoDataFrame(stops, geometry='geometry', crs=paths.crs)
+
+
+def join_nearby_stops(paths: GeoDataFrame, index: StopSpatialIndex,
+                      left_type: str = 'bus', right_type: str = 'tram',
+                      radius: float = DEFAULT_RADIUS_METERS,
+                      columns: List[str] = None,
+                      suffixes: Tuple[str, str] = (' автобус', ' трамвай')) -> GeoDataFrame:
+    """
+    Rus
+    Пространственное соединение статистик разных типов транспорта: для
+    каждой остановки транспорта left_type находятся все остановки
+    транспорта right_type в радиусе radius метров (парные платформы имеют
+    разные stop_id), и их статистики усредняются. Остановки без соседей
+    другого типа транспорта в результат не попадают. Геометрия берется от
+    остановок left_type
+
+    :param paths: layer with stop_id and transport_type columns (see
+    prepare_route_stops_layer)
+    :param index: spatial index of stops
+    :param left_type: transport type of stops in the result
+    :param right_type: transport type of neighbour stops
+    :param radius: search radius in meters
+    :param columns: names of columns to average. If None - PUNCTUALITY_COLUMNS
+    are used
+    :param suffixes: suffixes for columns of left_type and right_type stops
+
+    :return: layer with averaged statistics of both transport types,
+    number of neighbour stops and distance to the farthest of them
+    """
+    if columns is None:
+        columns = PUNCTUALITY_COLUMNS
+    left_stops = aggregate_by_stops(paths[paths['transport_type'] == left_type], columns)
+    right_stops = aggregate_by_stops(paths[paths['transport_type'] == right_type], columns)
+
+    # All pairs of stops are found at once, then only right_type neighbours remain
+    pairs = index.stops_within(radius, left_stops['stop_id'])
+    right_values = right_stops[['stop_id'] + columns].rename(columns={'stop_id': 'neighbour_stop_id'})
+    pairs = pairs.merge(right_values, on='neighbour_stop_id')
+
+    aggregation = {column: 'mean' for column in columns}
+    aggregation['neighbour_stop_id'] = 'size'
+    aggregation['distance'] = 'max'
+    neighbours = pairs.groupby('stop_id').agg(aggregation)
+    neighbours = neighbours.rename(columns={'neighbour_stop_id': 'neighbour_stops',
+                                            'distance': 'max_distance'})
+
+    joined = left_stops.merge(neighbours.reset_index(), on='stop_id', suffixes=suffixes)
+    return GeoDataFrame(joined, geometry='geometry', crs=paths.crs)
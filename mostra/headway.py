@@ -0,0 +1,112 @@
+import pandas as pd
+import numpy as np
+
+from mostra.instrumentation import instrumented
+
+import warnings
+warnings.filterwarnings('ignore')
+
+# Headway is a bunching if it is less than that fraction of the scheduled headway
+BUNCHING_RATIO = 0.5
+# Longer gaps are breaks in service (night, end of the day) - not headways
+MAX_HEADWAY_SECONDS = 2 * 60 * 60
+HEADWAY_KEYS = ['route_path_id', 'stop_id']
+
+
+@instrumented('headway')
+def calculate_headways(actual: pd.DataFrame, bunching_ratio: float = BUNCHING_RATIO,
+                       max_headway: float = MAX_HEADWAY_SECONDS) -> pd.DataFrame:
+    """
+    Rus
+    Рассчитывает интервалы движения (headway) - время между прибытиями
+    последовательных транспортных средств одного маршрута на одну остановку.
+    Прибытия один раз сортируются по (route_path_id, stop_id, arrival_time),
+    после чего интервалы для всех маршрутов и остановок считаются одной
+    разностью соседних элементов. Плановый интервал - разность времени по
+    расписанию (forecast_time) для той же пары прибытий. Интервал считается
+    сгоном (bunching), если он меньше bunching_ratio от планового
+
+    :param actual: table with actual arrival time (actual_vs_forecasted.csv)
+    :param bunching_ratio: fraction of the scheduled headway to detect bunching
+    :param max_headway: headways longer than that number of seconds are
+    breaks in service and are not included into the table
+
+    :return: table with route_path_id, stop_id, tmId, arrival_time, headway,
+    scheduled_headway (in seconds) and is_bunching columns. First arrival at
+    each stop has no headway and is not included
+    """
+    # Several scheduled items can be matched with the same arrival
+    arrivals = actual[HEADWAY_KEYS + ['tmId', 'arrival_time', 'forecast_time']]
+    arrivals = arrivals.drop_duplicates(subset=HEADWAY_KEYS + ['tmId', 'arrival_time'])
+
+    route_codes, routes = pd.factorize(arrivals['route_path_id'])
+    stop_codes, stops = pd.factorize(arrivals['stop_id'])
+    arrival_time = arrivals['arrival_time'].to_numpy(dtype=float)
+    order = np.lexsort((arrival_time, stop_codes, route_codes))
+    route_codes, stop_codes = route_codes[order], stop_codes[order]
+    arrival_time = arrival_time[order]
+    forecast_time = arrivals['forecast_time'].to_numpy(dtype=float)[order]
+
+    # Differences inside each (route, stop) group - the first row of the
+    # group is compared with the previous group and is dropped
+    is_same_group = (route_codes[1:] == route_codes[:-1]) & (stop_codes[1:] == stop_codes[:-1])
+    headway = np.diff(arrival_time)
+    scheduled_headway = np.diff(forecast_time)
+    is_selected = is_same_group & (headway <= max_headway)
+    selected = np.flatnonzero(is_selected) + 1
+
+    headways = pd.DataFrame({'route_path_id': pd.Categorical.from_codes(route_codes[selected], routes),
+                             'stop_id': pd.Categorical.from_codes(stop_codes[selected], stops),
+                             'tmId': arrivals['tmId'].to_numpy()[order][selected],
+                             'arrival_time': arrival_time[selected],
+                             'headway': headway[is_selected].astype(np.float32),
+                             'scheduled_headway': scheduled_headway[is_selected].astype(np.float32)})
+    # Vehicles can arrive in the other order than scheduled - such intervals
+    # have no meaningful scheduled headway
+    has_schedule = headways['scheduled_headway'] > 0
+    headways['is_bunching'] = has_schedule & (headways['headway'] < bunching_ratio * headways['scheduled_headway'])
+    return headways
+
+
+def stop_headway_report(headways: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rus
+    Статистика интервалов движения для каждой пары "маршрут - остановка":
+    число интервалов, средний интервал и его стандартное отклонение (в
+    минутах), коэффициент вариации (отношение стандартного отклонения к
+    среднему) и число сгонов
+
+    :param headways: table with headways (see calculate_headways)
+    """
+    report = headways.groupby(HEADWAY_KEYS, sort=False, observed=True).agg(headways=('headway', 'size'),
+                                                                           mean_headway=('headway', 'mean'),
+                                                                           std_headway=('headway', 'std'),
+                                                                           bunching=('is_bunching', 'sum'))
+    report['cv'] = report['std_headway'] / report['mean_headway']
+    report['mean_headway'] = report['mean_headway'] / 60
+    report['std_headway'] = report['std_headway'] / 60
+    return report.reset_index()
+
+
+@instrumented('report')
+def route_headway_report(headways: pd.DataFrame) -> pd.DataFrame:
+    """
+    Rus
+    Сводка по интервалам движения для каждого маршрута: число интервалов,
+    средний интервал (в минутах), средний по остановкам коэффициент вариации
+    интервалов, число сгонов и их доля (в процентах). Большой коэффициент
+    вариации означает нерегулярное движение
+
+    :param headways: table with headways (see calculate_headways)
+    """
+    stop_report = stop_headway_report(headways)
+    report = stop_report.groupby('route_path_id', sort=False, observed=True).agg(stops=('stop_id', 'size'),
+                                                                                 headways=('headways', 'sum'),
+                                                                                 mean_cv=('cv', 'mean'),
+                                                                                 bunching=('bunching', 'sum'))
+    mean_headway = headways.groupby('route_path_id', sort=False, observed=True)['headway'].mean() / 60
+    report['mean_headway'] = mean_headway
+    report['bunching_ratio'] = (report['bunching'] / report['headways'] * 100).round(1)
+    report = report.reset_index()
+    return report[['route_path_id', 'stops', 'headways', 'mean_headway', 'mean_cv',
+                   'bunching', 'bunching_ratio']]
@@ -0,0 +1,155 @@
+from functools import lru_cache
+from pathlib import Path
+from typing import List, Union
+
+import pandas as pd
+import numpy as np
+
+from mostra.paths import get_data_path
+
+import warnings
+warnings.filterwarnings('ignore')
+
+try:
+    import fcntl
+except ImportError:
+    # No file locks on Windows - concurrent appends are not protected
+    fcntl = None
+
+# Columns with UUID strings which are replaced with integer codes
+ID_COLUMNS = ['stop_id', 'route_path_id']
+# Code for missing identifiers (NaN or None). It is not stored in the file
+MISSING_CODE = -1
+
+
+class IdDictionary:
+    """
+    Rus
+    Словарь для замены строковых идентификаторов (UUID остановок и маршрутов)
+    на целые числа int32. Код идентификатора - номер строки в файле словаря.
+    Новые идентификаторы только дописываются в конец файла, поэтому коды не
+    меняются между запусками и одинаковы для всех таблиц (pred_data.csv,
+    stop_from_repo.csv и производных от них)
+
+    :param path: path to the text file with one identifier per line. If file
+    does not exist - it will be created when new identifiers appear
+    """
+
+    def __init__(self, path: Union[Path, str]):
+        self.path = Path(path)
+        values = []
+        if self.path.is_file():
+            with open(self.path, 'r') as f:
+                values = f.read().splitlines()
+        self._set_values(values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def encode(self, values: Union[pd.Series, np.ndarray, list]) -> np.ndarray:
+        """
+        Return int32 codes for identifiers. Unknown identifiers are added to
+        the dictionary. Missing values get MISSING_CODE
+        """
+        values = pd.Series(values)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Encode only categories - it is much faster for repeated values
+            category_codes = self.encode(values.cat.categories.astype(str))
+            # Missing values have code -1 and take the appended MISSING_CODE
+            category_codes = np.append(category_codes, MISSING_CODE).astype(np.int32)
+            return category_codes[values.cat.codes.to_numpy()]
+
+        is_missing = values.isna().to_numpy()
+        values = values.astype(str).to_numpy()
+        codes = self._index.get_indexer(values)
+        codes[is_missing] = MISSING_CODE
+        is_new = (codes < 0) & ~is_missing
+        if is_new.any():
+            self._add(pd.unique(values[is_new]))
+            codes[is_new] = self._index.get_indexer(values[is_new])
+        return codes.astype(np.int32)
+
+    def decode(self, codes: Union[pd.Series, np.ndarray, list]) -> np.ndarray:
+        """ Return identifiers for int32 codes. MISSING_CODE is decoded into NaN """
+        codes = np.asarray(codes, dtype=np.int64)
+        if len(codes) > 0 and codes.max() >= len(self._values):
+            # Codes could be added by another process
+            self._reload()
+        is_missing = codes == MISSING_CODE
+        values = self._values[np.where(is_missing, 0, codes)] if len(self._values) > 0 \
+            else np.empty(len(codes), dtype=object)
+        values[is_missing] = np.nan
+        return values
+
+    def _add(self, new_values: np.ndarray):
+        """
+        Append identifiers to the file. The file is locked and read again
+        before appending, so identifiers which were added by another process
+        keep their codes and are not duplicated
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                values = f.read().splitlines()
+                known = pd.Index(values)
+                new_values = [value for value in new_values if value not in known]
+                f.writelines(f'{value}\n' for value in new_values)
+                f.flush()
+                values.extend(new_values)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        self._set_values(values)
+
+    def _reload(self):
+        with open(self.path, 'r') as f:
+            self._set_values(f.read().splitlines())
+
+    def _set_values(self, values: list):
+        self._values = np.array(values, dtype=object)
+        self._index = pd.Index(self._values)
+        if not self._index.is_unique:
+            raise ValueError(f'Dictionary {self.path} contains duplicated identifiers')
+
+
+@lru_cache(maxsize=None)
+def get_id_dictionary(path: Union[Path, str] = None) -> IdDictionary:
+    """ Return dictionary with identifiers. If path is None - data/id_dictionary.txt is used """
+    if path is None:
+        path = Path(get_data_path(), 'id_dictionary.txt')
+    return IdDictionary(path)
+
+
+def encode_id_columns(df: pd.DataFrame, ids: IdDictionary = None,
+                      columns: List[str] = None) -> pd.DataFrame:
+    """
+    Replace UUID strings in columns with int32 codes (in place)
+
+    :param df: table to encode
+    :param ids: dictionary with identifiers. If None - default dictionary is used
+    :param columns: columns to encode. If None - ID_COLUMNS which are in
+    the table are used
+    """
+    if ids is None:
+        ids = get_id_dictionary()
+    if columns is None:
+        columns = [column for column in ID_COLUMNS if column in df.columns]
+    for column in columns:
+        df[column] = ids.encode(df[column])
+    return df
+
+
+def decode_id_columns(df: pd.DataFrame, ids: IdDictionary = None,
+                      columns: List[str] = None) -> pd.DataFrame:
+    """ Return copy of the table with int32 codes replaced back with UUID strings """
+    if ids is None:
+        ids = get_id_dictionary()
+    if columns is None:
+        columns = [column for column in ID_COLUMNS if column in df.columns]
+    df = df.copy()
+    for column in columns:
+        df[column] = ids.decode(df[column])
+    return df
@@ -0,0 +1,322 @@
+import hashlib
+import io
+import json
+from pathlib import Path
+from typing import Optional, Union
+
+import pandas as pd
+import numpy as np
+
+from mostra.arrival import BELONG_CASE_SECONDS_TEL_THRESHOLD, calculate_arrival_time
+from mostra.catalog import StopCatalog, get_stop_catalog
+from mostra.data_structure import COLUMN_NAMES
+from mostra.io import read_pred_data_csv
+from mostra.paths import create_folder, get_data_path
+from mostra.preprocessing import CASE_KEYS, SINGLE_CASE_SECONDS_THRESHOLD, \
+    aggregate_schedule_items, label_schedule_cases
+
+import warnings
+warnings.filterwarnings('ignore')
+
+# Case can be extended by new requests while its latest forecast or request
+# time is not older than that number of seconds relative to the watermark.
+# Double threshold is used because forecasts can be slightly in the past
+OPEN_CASE_SECONDS = 2 * SINGLE_CASE_SECONDS_THRESHOLD
+# Telemetry of triples without scheduled data is kept aside in files per
+# hour of request time. Files older than retention (relative to the
+# watermark) are removed
+UNSCHEDULED_BUCKET_SECONDS = 60 * 60
+UNSCHEDULED_RETENTION_SECONDS = 24 * 60 * 60
+# Number of bytes at the beginning and before the end of the processed part
+# of the file to detect that the file was rewritten
+FINGERPRINT_BYTES = 4096
+
+
+class IncrementalPipeline:
+    """
+    Rus
+    Инкрементальный пересчет таблиц pred_data_preprocessed.csv и
+    actual_vs_forecasted.csv для постоянно дополняемого файла pred_data.csv.
+
+    Хранится водяной знак (watermark) - максимальное время запроса
+    request_time среди обработанных строк. При очередном запуске читаются
+    только новые строки файла. Пересчитываются только открытые кейсы - те,
+    которые еще могут быть дополнены новыми строками (последнее время кейса
+    не старше OPEN_CASE_SECONDS относительно водяного знака). Исходные
+    строки открытых кейсов хранятся в папке состояния. Итоговые таблицы
+    состоят из двух частей: закрытые кейсы дописываются в начало файла и
+    больше не меняются, а строки открытых кейсов перезаписываются в конце
+    файла при каждом запуске (upsert).
+
+    Предполагается, что новые строки дописываются в конец файла в порядке
+    времени запросов (поэтому общего водяного знака достаточно - отдельные
+    водяные знаки для троек "маршрут - остановка - транспорт" не хранятся).
+    Если файл был перезаписан (изменилось начало файла или уже обработанная
+    часть), то все таблицы пересчитываются заново.
+
+    Для троек хранится только признак наличия данных расписания. Закрытые
+    данные телеметрии для троек без данных расписания откладываются в папку
+    состояния и попадают в итоговую таблицу, когда для тройки появятся
+    данные расписания. Такие данные хранятся не дольше
+    UNSCHEDULED_RETENTION_SECONDS - в отличие от полного пересчета, более
+    старая телеметрия не попадает в pred_data_preprocessed.csv (для расчета
+    времени прибытия она все равно слишком далека от данных расписания)
+
+    :param csv_path: path to the pred_data.csv file. If None - file from data
+    folder is used. Output tables are saved into the same folder
+    :param state_folder: folder to store watermark and rows of open cases.
+    If None - folder "incremental" next to the csv file is used
+    :param catalog: catalog of stops and routes. If None - catalog is loaded
+    from stop_from_repo.csv
+    """
+
+    def __init__(self, csv_path: Union[Path, str] = None,
+                 state_folder: Union[Path, str] = None,
+                 catalog: Optional[StopCatalog] = None):
+        if csv_path is None:
+            csv_path = Path(get_data_path(), 'pred_data.csv')
+        self.csv_path = Path(csv_path)
+        data_folder = self.csv_path.parent
+        if state_folder is None:
+            state_folder = Path(data_folder, 'incremental')
+        self.state_folder = create_folder(state_folder)
+        if catalog is None:
+            catalog = get_stop_catalog()
+        self.catalog = catalog
+
+        self.preprocessed_path = Path(data_folder, 'pred_data_preprocessed.csv')
+        self.arrival_path = Path(data_folder, 'actual_vs_forecasted.csv')
+
+        self._state_path = Path(self.state_folder, 'state.json')
+        self._scheduled_keys_path = Path(self.state_folder, 'scheduled_keys.csv')
+        self._open_rows_path = Path(self.state_folder, 'open_rows.csv')
+        self._unscheduled_folder = Path(self.state_folder, 'unscheduled_telemetry')
+        # Triples with scheduled data. Loaded from file once and then only
+        # new triples are appended to the file
+        self._scheduled_keys = None
+
+    def refresh(self) -> int:
+        """
+        Process rows which were appended to the csv file since the previous
+        launch and update output tables
+
+        :return: number of processed new rows
+        """
+        state = self._load_state()
+        if state['offset'] > 0 and (self.csv_path.stat().st_size < state['offset'] or
+                                    self._get_fingerprint(state['offset']) != state.get('fingerprint')):
+            # File was rewritten - start from scratch
+            state = self._initial_state()
+
+        new_rows, state['offset'] = self._read_new_rows(state['offset'])
+        state['fingerprint'] = self._get_fingerprint(state['offset'])
+        if len(new_rows) < 1:
+            self._save_state(state)
+            return 0
+
+        new_scheduled_keys = self._update_scheduled_keys(new_rows)
+        state['watermark'] = max(state['watermark'], int(new_rows['request_time'].max()))
+        candidate = pd.concat([self._load_open_rows(state), new_rows], ignore_index=True)
+
+        is_sealed = self._define_sealed_rows(candidate, state['watermark'])
+        sealed_rows = pd.concat([candidate[is_sealed],
+                                 self._release_unscheduled_telemetry(new_scheduled_keys)])
+        sealed_rows = self._keep_unscheduled_telemetry(sealed_rows, state['watermark'])
+        sealed_preprocessed = self._preprocess(sealed_rows)
+        open_preprocessed = self._preprocess(candidate[~is_sealed])
+        sealed_arrival, open_arrival = self._calculate_arrival_time(sealed_preprocessed, open_preprocessed)
+
+        state['preprocessed_sealed_size'] = _upsert(self.preprocessed_path, state['preprocessed_sealed_size'],
+                                                    sealed_preprocessed, open_preprocessed)
+        state['arrival_sealed_size'] = _upsert(self.arrival_path, state['arrival_sealed_size'],
+                                               sealed_arrival, open_arrival)
+
+        candidate[~is_sealed][COLUMN_NAMES].to_csv(self._open_rows_path, index=False, header=False)
+        self._save_state(state)
+        return len(new_rows)
+
+    def _read_new_rows(self, offset: int):
+        """ Read complete lines appended after offset. Return rows and new offset """
+        with open(self.csv_path, 'rb') as f:
+            f.seek(offset)
+            content = f.read()
+        # The last line can still be written - skip it
+        content = content[:content.rfind(b'\n') + 1]
+        if len(content) < 1:
+            return pd.DataFrame(columns=COLUMN_NAMES), offset
+        return read_pred_data_csv(io.BytesIO(content)), offset + len(content)
+
+    def _get_fingerprint(self, offset: int) -> dict:
+        """ Inode and hashes of the beginning and the end of the first offset bytes of the file """
+        with open(self.csv_path, 'rb') as f:
+            head = f.read(min(offset, FINGERPRINT_BYTES))
+            f.seek(max(offset - FINGERPRINT_BYTES, 0))
+            tail = f.read(min(offset, FINGERPRINT_BYTES))
+        return {'inode': self.csv_path.stat().st_ino,
+                'head': hashlib.sha1(head).hexdigest(),
+                'tail': hashlib.sha1(tail).hexdigest()}
+
+    @property
+    def scheduled_keys(self) -> pd.MultiIndex:
+        """ Triples (route_path_id, stop_id, tmId) which have scheduled data """
+        if self._scheduled_keys is None:
+            self._scheduled_keys = _get_keys(pd.DataFrame(columns=CASE_KEYS))
+            if self._scheduled_keys_path.is_file():
+                keys = pd.read_csv(self._scheduled_keys_path, dtype={'route_path_id': str, 'stop_id': str})
+                self._scheduled_keys = _get_keys(keys)
+        return self._scheduled_keys
+
+    def _update_scheduled_keys(self, new_rows: pd.DataFrame) -> pd.MultiIndex:
+        """ Append triples which got scheduled data for the first time and return them """
+        new_keys = _get_keys(new_rows[new_rows['byTelemetry'] == 0]).unique()
+        new_keys = new_keys.difference(self.scheduled_keys)
+        if len(new_keys) > 0:
+            new_keys.to_frame(index=False).to_csv(self._scheduled_keys_path, mode='a', index=False,
+                                                  header=not self._scheduled_keys_path.is_file())
+            self._scheduled_keys = self.scheduled_keys.append(new_keys)
+        return new_keys
+
+    @staticmethod
+    def _define_sealed_rows(candidate: pd.DataFrame, watermark: int) -> pd.Series:
+        """
+        Define rows which can not be changed by new data. Scheduled rows are
+        sealed by cases. Telemetry is kept while it can be matched with
+        open scheduled cases
+        """
+        is_sealed = pd.Series(False, index=candidate.index)
+        bound = watermark - OPEN_CASE_SECONDS
+        latest_time = np.maximum(candidate['forecast_time'], candidate['request_time'])
+
+        scheduled = candidate[candidate['byTelemetry'] == 0]
+        scheduled = scheduled.sort_values(by=CASE_KEYS + ['forecast_time'], kind='mergesort')
+        cases = label_schedule_cases(scheduled)
+        case_end = latest_time[scheduled.index].groupby(cases).transform('max')
+        is_sealed[scheduled.index] = case_end < bound
+
+        # Start of the earliest open case for each triple
+        open_scheduled = scheduled[case_end >= bound]
+        open_start = open_scheduled.groupby(CASE_KEYS, observed=True)['forecast_time'].min()
+        open_start = open_start.rename('open_start').reset_index()
+
+        telemetry = candidate[candidate['byTelemetry'] == 1][CASE_KEYS + ['forecast_time']]
+        telemetry = telemetry.reset_index().merge(open_start, on=CASE_KEYS, how='left').set_index('index')
+        is_far_from_open = ~(telemetry['forecast_time'] > telemetry['open_start'] - BELONG_CASE_SECONDS_TEL_THRESHOLD)
+        is_old = latest_time[telemetry.index] + BELONG_CASE_SECONDS_TEL_THRESHOLD < bound
+        is_sealed[telemetry.index] = is_far_from_open & is_old
+        return is_sealed
+
+    def _keep_unscheduled_telemetry(self, sealed_rows: pd.DataFrame, watermark: int) -> pd.DataFrame:
+        """
+        Sealed telemetry of triples without scheduled data is saved aside:
+        scheduled data for such triples can appear later. Files with
+        telemetry older than retention are removed
+        """
+        is_unscheduled = (sealed_rows['byTelemetry'] == 1) & ~_get_keys(sealed_rows).isin(self.scheduled_keys)
+        unscheduled = sealed_rows[is_unscheduled][COLUMN_NAMES]
+        if len(unscheduled) > 0:
+            create_folder(self._unscheduled_folder)
+            buckets = unscheduled['request_time'] // UNSCHEDULED_BUCKET_SECONDS
+            for bucket, bucket_rows in unscheduled.groupby(buckets):
+                bucket_rows.to_csv(Path(self._unscheduled_folder, f'{bucket}.csv'),
+                                   mode='a', index=False, header=False)
+
+        oldest_bucket = (watermark - UNSCHEDULED_RETENTION_SECONDS) // UNSCHEDULED_BUCKET_SECONDS
+        for bucket_path in self._unscheduled_folder.glob('*.csv'):
+            if int(bucket_path.stem) < oldest_bucket:
+                bucket_path.unlink()
+        return sealed_rows[~is_unscheduled]
+
+    def _release_unscheduled_telemetry(self, new_scheduled_keys: pd.MultiIndex) -> pd.DataFrame:
+        """ Return saved aside telemetry for triples which got scheduled data """
+        released = [pd.DataFrame(columns=COLUMN_NAMES)]
+        if len(new_scheduled_keys) < 1:
+            return released[0]
+
+        for bucket_path in sorted(self._unscheduled_folder.glob('*.csv'), key=lambda path: int(path.stem)):
+            telemetry = read_pred_data_csv(bucket_path)
+            is_released = _get_keys(telemetry).isin(new_scheduled_keys)
+            if not is_released.any():
+                continue
+            released.append(telemetry[is_released])
+            if is_released.all():
+                bucket_path.unlink()
+            else:
+                telemetry[~is_released].to_csv(bucket_path, index=False, header=False)
+        return pd.concat(released)
+
+    def _preprocess(self, raw_rows: pd.DataFrame) -> pd.DataFrame:
+        """ Aggregate scheduled items. Telemetry is kept for triples with scheduled data """
+        scheduled = aggregate_schedule_items(raw_rows[raw_rows['byTelemetry'] == 0][COLUMN_NAMES])
+
+        # Scheduled data for the triple can be in other (sealed or open) part
+        telemetry = raw_rows[raw_rows['byTelemetry'] == 1][COLUMN_NAMES]
+        telemetry = telemetry[_get_keys(telemetry).isin(self.scheduled_keys)]
+        telemetry = telemetry.drop(columns=['id'])
+        telemetry['forecast_time_datetime'] = pd.to_datetime(telemetry['forecast_time'], unit='s')
+        telemetry['request_time_datetime'] = pd.to_datetime(telemetry['request_time'], unit='s')
+
+        preprocessed = pd.concat([telemetry, scheduled])
+        return preprocessed.sort_values(by=CASE_KEYS, kind='mergesort')
+
+    def _calculate_arrival_time(self, sealed_preprocessed: pd.DataFrame, open_preprocessed: pd.DataFrame):
+        """
+        Calculate arrival time for both parts at once (telemetry of open part
+        can belong to sealed cases) and split results back
+        """
+        preprocessed = pd.concat([sealed_preprocessed.assign(is_sealed=True),
+                                  open_preprocessed.assign(is_sealed=False)])
+        arrival = calculate_arrival_time(preprocessed, self.catalog)
+        if len(arrival) < 1:
+            return arrival, arrival
+
+        is_sealed = arrival['is_sealed'].astype(bool)
+        arrival = arrival.drop(columns=['is_sealed'])
+        return arrival[is_sealed], arrival[~is_sealed]
+
+    def _initial_state(self) -> dict:
+        for path in [self._scheduled_keys_path, self._open_rows_path, *self._unscheduled_folder.glob('*.csv')]:
+            if path.is_file():
+                path.unlink()
+        self._scheduled_keys = None
+        return {'offset': 0, 'watermark': 0, 'fingerprint': None,
+                'preprocessed_sealed_size': 0, 'arrival_sealed_size': 0}
+
+    def _load_state(self) -> dict:
+        if not self._state_path.is_file():
+            return self._initial_state()
+        with open(self._state_path, 'r') as f:
+            return json.load(f)
+
+    def _save_state(self, state: dict):
+        with open(self._state_path, 'w') as f:
+            json.dump(state, f)
+
+    def _load_open_rows(self, state: dict) -> pd.DataFrame:
+        if state['offset'] == 0 or not self._open_rows_path.is_file() or \
+                self._open_rows_path.stat().st_size == 0:
+            return pd.DataFrame(columns=COLUMN_NAMES)
+        return read_pred_data_csv(self._open_rows_path)
+
+
+def _get_keys(df: pd.DataFrame) -> pd.MultiIndex:
+    """ Triples (route_path_id, stop_id, tmId) of rows with the same types for all tables """
+    keys = df[CASE_KEYS].astype({'route_path_id': str, 'stop_id': str, 'tmId': np.int64})
+    return pd.MultiIndex.from_frame(keys)
+
+
+def _upsert(path: Path, sealed_size: int, sealed_df: pd.DataFrame, open_df: pd.DataFrame) -> int:
+    """
+    Replace rows of open cases at the end of the file: the file is cut to
+    the size of sealed part, then new sealed rows and all open rows are
+    appended. Return new size of the sealed part
+    """
+    with open(path, 'ab') as f:
+        f.truncate(sealed_size)
+
+    if len(sealed_df) > 0:
+        sealed_df.to_csv(path, mode='a', index=False, header=sealed_size == 0)
+    sealed_size = path.stat().st_size
+
+    if len(open_df) > 0:
+        open_df.to_csv(path, mode='a', index=False, header=sealed_size == 0)
+    return sealed_size
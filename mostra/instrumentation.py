@@ -0,0 +1,232 @@
+import cProfile
+import datetime
+import functools
+import json
+import math
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Union
+
+import warnings
+warnings.filterwarnings('ignore')
+
+try:
+    import resource
+except ImportError:
+    # No resource module on Windows - psutil is used if it is installed
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Instrumentation can be enabled without code changes (worker processes
+# started with "spawn" also read these variables)
+STAGES_LOG_ENV = 'MOSTRA_STAGES_LOG'
+PROFILE_FOLDER_ENV = 'MOSTRA_PROFILE_FOLDER'
+# Interval of current memory sampling inside the stage
+RSS_SAMPLE_SECONDS = 0.01
+
+_SETTINGS = {'stages_log': os.environ.get(STAGES_LOG_ENV),
+             'profile_folder': os.environ.get(PROFILE_FOLDER_ENV)}
+# Only one profiler can be active - nested stages are included into the
+# profile of the outer stage
+_PROFILING = {'active': False}
+
+
+def configure_instrumentation(stages_log: Union[Path, str] = None,
+                              profile_folder: Union[Path, str] = None):
+    """
+    Rus
+    Включает запись метрик этапов обработки. Для каждого этапа в файл
+    stages_log дописывается строка JSON с временем выполнения (общим и
+    процессорным), числом строк на входе и выходе и потреблением памяти:
+        - peak_rss_mb - пиковое потребление памяти процессом с его запуска
+        (не зависит от этапа, если раньше был этап с большим потреблением)
+        - stage_peak_rss_mb - максимальное потребление памяти во время
+        этапа (текущий RSS замеряется каждые RSS_SAMPLE_SECONDS секунд,
+        поэтому более короткие пики могут быть пропущены)
+        - stage_rss_growth_mb - насколько stage_peak_rss_mb больше
+        потребления памяти в начале этапа
+    Если задана папка profile_folder, то для каждого этапа
+    сохраняется профиль cProfile (файл .prof). Значения передаются в
+    дочерние процессы через переменные окружения
+
+    :param stages_log: path to the JSON lines file. If None - metrics are
+    not recorded
+    :param profile_folder: folder to save cProfile dumps into. If None -
+    stages are not profiled
+    """
+    for key, env, value in [('stages_log', STAGES_LOG_ENV, stages_log),
+                            ('profile_folder', PROFILE_FOLDER_ENV, profile_folder)]:
+        _SETTINGS[key] = None if value is None else str(value)
+        if value is None:
+            os.environ.pop(env, None)
+        else:
+            os.environ[env] = str(value)
+
+
+def is_instrumentation_enabled() -> bool:
+    return _SETTINGS['stages_log'] is not None or _SETTINGS['profile_folder'] is not None
+
+
+def get_peak_rss_mb() -> float:
+    """ Peak resident set size of the current process in megabytes (NaN if it can not be measured) """
+    if resource is None:
+        if psutil is None:
+            return float('nan')
+        memory_info = psutil.Process().memory_info()
+        # Peak working set is available on Windows only
+        return getattr(memory_info, 'peak_wset', memory_info.rss) / 1024 / 1024
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if platform.system() == 'Darwin':
+        # macOS reports bytes, Linux - kilobytes
+        return peak_rss / 1024 / 1024
+    return peak_rss / 1024
+
+
+def get_current_rss_mb() -> float:
+    """ Current resident set size of the process in megabytes (NaN if it can not be measured) """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+    except OSError:
+        return float('nan')
+    return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+class RssSampler:
+    """ Background thread which tracks max current memory of the process until stop is called """
+
+    def __init__(self, interval: float = RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.start_rss = get_current_rss_mb()
+        self.peak_rss = self.start_rss
+        self._stop_event = threading.Event()
+        self._thread = None
+        if not math.isnan(self.start_rss):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> float:
+        """ Stop sampling and return max memory in megabytes """
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+        return self.peak_rss
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        self.peak_rss = max(self.peak_rss, get_current_rss_mb())
+
+
+@contextmanager
+def track_stage(stage: str, rows_in: int = None):
+    """
+    Rus
+    Контекстный менеджер для замера этапа обработки. Возвращает словарь, в
+    который можно записать число строк на выходе (ключ rows_out) и любые
+    дополнительные значения. Если запись метрик не включена (см.
+    configure_instrumentation), то ничего не замеряется
+
+    Example:
+        with track_stage('aggregate', rows_in=len(df)) as record:
+            final_df = aggregate_schedule_items(df)
+            record['rows_out'] = len(final_df)
+
+    :param stage: name of the stage
+    :param rows_in: number of input rows
+    """
+    record = {'stage': stage, 'rows_in': rows_in, 'rows_out': None}
+    if not is_instrumentation_enabled():
+        yield record
+        return
+
+    profiler = None
+    if _SETTINGS['profile_folder'] is not None and not _PROFILING['active']:
+        profiler = cProfile.Profile()
+        _PROFILING['active'] = True
+
+    start_datetime = datetime.datetime.now()
+    rss_sampler = RssSampler()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _PROFILING['active'] = False
+        stage_peak_rss = rss_sampler.stop()
+        record.update({'start': start_datetime.isoformat(timespec='milliseconds'),
+                       'wall_seconds': round(time.perf_counter() - wall_start, 4),
+                       'cpu_seconds': round(time.process_time() - cpu_start, 4),
+                       'peak_rss_mb': _round_mb(get_peak_rss_mb()),
+                       'stage_peak_rss_mb': _round_mb(stage_peak_rss),
+                       'stage_rss_growth_mb': _round_mb(stage_peak_rss - rss_sampler.start_rss),
+                       'pid': os.getpid()})
+        if profiler is not None:
+            _dump_profile(profiler, stage, start_datetime)
+        if _SETTINGS['stages_log'] is not None:
+            _write_record(record)
+
+
+def instrumented(stage: str) -> Callable:
+    """
+    Decorator to record function as a stage (see track_stage). Number of
+    input rows is the length of the first argument and number of output rows
+    is the length of the result (if they are tables)
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not is_instrumentation_enabled():
+                return func(*args, **kwargs)
+
+            rows_in = _get_length(args[0]) if len(args) > 0 else None
+            with track_stage(stage, rows_in) as record:
+                result = func(*args, **kwargs)
+                record['rows_out'] = _get_length(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def _round_mb(value: float):
+    """ Round memory value for the record (None if memory can not be measured) """
+    return None if math.isnan(value) else round(value, 1)
+
+
+def _get_length(obj):
+    """ Number of rows for tables and arrays (None for other objects) """
+    if hasattr(obj, 'shape'):
+        return len(obj)
+    return None
+
+
+def _write_record(record: dict):
+    stages_log = Path(_SETTINGS['stages_log'])
+    stages_log.parent.mkdir(parents=True, exist_ok=True)
+    # Single short write per line - records from several processes do not mix
+    with open(stages_log, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+
+
+def _dump_profile(profiler: cProfile.Profile, stage: str, start_datetime: datetime.datetime):
+    profile_folder = Path(_SETTINGS['profile_folder'])
+    profile_folder.mkdir(parents=True, exist_ok=True)
+    profile_name = f'{stage}_{start_datetime.strftime("%Y%m%dT%H%M%S_%f")}_{os.getpid()}.prof'
+    profiler.dump_stats(Path(profile_folder, profile_name))
@@ -0,0 +1,82 @@
+import os
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+
+from mostra.data_structure import COLUMN_NAMES
+from mostra.ids import encode_id_columns
+from mostra.instrumentation import instrumented
+from mostra.paths import get_data_path
+
+import warnings
+warnings.filterwarnings('ignore')
+
+# UUID strings are repeated millions of times - keep them as categories
+PRED_DATA_DTYPES = {'stop_id': 'category',
+                    'route_path_id': 'category',
+                    'forecast_time': 'int32',
+                    'byTelemetry': 'bool',
+                    'tmId': 'int32',
+                    'request_time': 'int32'}
+
+
+def read_pred_data_csv(csv_path: Union[Path, str], **kwargs):
+    """
+    Read raw prediction log (pred_data.csv) with explicit column types
+
+    :param csv_path: path to the csv file without header
+    :param kwargs: additional parameters for pandas read_csv (chunksize for
+    example)
+    """
+    return pd.read_csv(csv_path, names=COLUMN_NAMES, dtype=PRED_DATA_DTYPES, **kwargs)
+
+
+@instrumented('load')
+def load_pred_data(csv_path: Union[Path, str] = None, use_cache: bool = True,
+                   encode_ids: bool = False) -> pd.DataFrame:
+    """
+    Rus
+    Загружает исходный датасет pred_data.csv с заданными типами колонок.
+    При первом чтении рядом с csv файлом сохраняется его копия в формате
+    parquet, которая используется до тех пор, пока не изменится время
+    модификации csv файла. Если pyarrow (или fastparquet) не установлен,
+    то таблица каждый раз читается из csv
+
+    :param csv_path: path to the csv file. If None - pred_data.csv from data
+    folder is used
+    :param use_cache: is there a need to use (and create) parquet sidecar
+    :param encode_ids: replace stop_id and route_path_id with int32 codes
+    from the shared dictionary (see mostra.ids)
+    """
+    df = _load_pred_data(csv_path, use_cache)
+    if encode_ids:
+        df = encode_id_columns(df)
+    return df
+
+
+def _load_pred_data(csv_path: Union[Path, str], use_cache: bool) -> pd.DataFrame:
+    if csv_path is None:
+        csv_path = Path(get_data_path(), 'pred_data.csv')
+    csv_path = Path(csv_path)
+    if not use_cache:
+        return read_pred_data_csv(csv_path)
+
+    sidecar_path = csv_path.with_suffix('.parquet')
+    csv_mtime = csv_path.stat().st_mtime_ns
+    if sidecar_path.is_file() and sidecar_path.stat().st_mtime_ns == csv_mtime:
+        try:
+            return pd.read_parquet(sidecar_path)
+        except ImportError:
+            return read_pred_data_csv(csv_path)
+
+    df = read_pred_data_csv(csv_path)
+    try:
+        df.to_parquet(sidecar_path, index=False)
+    except ImportError:
+        # There is no parquet engine - work without cache
+        return df
+
+    # Sidecar is valid while it has the same modification time as csv file
+    os.utime(sidecar_path, ns=(csv_mtime, csv_mtime))
+    return df
@@ -0,0 +1,212 @@
+import asyncio
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional, Union
+
+from mostra.arrival import CASE_SECONDS_TEL_THRESHOLD
+from mostra.data_structure import COLUMN_NAMES, MIN_FORECAST_HORIZON_SECONDS
+from mostra.log import get_logger
+from mostra.preprocessing import SINGLE_CASE_SECONDS_THRESHOLD
+
+import warnings
+warnings.filterwarnings('ignore')
+
+logger = get_logger(__name__)
+
+# Single row of pred_data.csv
+PredictionEvent = namedtuple('PredictionEvent', COLUMN_NAMES)
+
+# Max number of simultaneously open cases - the oldest cases are evicted
+# when the limit is reached
+DEFAULT_MAX_OPEN_CASES = 100000
+# Number of lines to read from file before other tasks can run
+READ_BATCH_LINES = 1000
+TAIL_POLL_SECONDS = 0.5
+
+
+class OpenCase:
+    """ State of single case for triple "route - stop - vehicle" """
+    __slots__ = ['scheduled_sum', 'scheduled_count', 'max_scheduled_time', 'last_seen', 'is_arrived']
+
+    def __init__(self, forecast_time: int, last_seen: int):
+        self.scheduled_sum = forecast_time
+        self.scheduled_count = 1
+        self.max_scheduled_time = forecast_time
+        self.last_seen = last_seen
+        self.is_arrived = False
+
+    @property
+    def scheduled_time(self) -> float:
+        return self.scheduled_sum / self.scheduled_count
+
+
+class LiveArrivalEstimator:
+    """
+    Rus
+    Потоковая оценка фактического времени прибытия по событиям журнала
+    прогнозов (поля как в COLUMN_NAMES), которые поступают в порядке
+    времени запроса. Для каждой тройки "маршрут - остановка - транспорт"
+    хранится открытый кейс: среднее прогнозное время по расписанию и время
+    последнего события. Новый кейс открывается, если прогноз по расписанию
+    позже прогнозов текущего кейса на SINGLE_CASE_SECONDS_THRESHOLD секунд
+    и более. Как только для кейса приходит прогноз по телеметрии с
+    заблаговременностью меньше MIN_FORECAST_HORIZON_SECONDS (и не дальше
+    CASE_SECONDS_TEL_THRESHOLD секунд от расписания), выдается запись о
+    прибытии. Кейсы без событий дольше ttl_seconds (по времени потока -
+    максимальному request_time) удаляются, а число открытых кейсов
+    ограничено max_open_cases, поэтому память не растет с длиной потока
+
+    :param ttl_seconds: time to keep case without new events
+    :param max_open_cases: max number of cases in memory
+    """
+
+    def __init__(self, ttl_seconds: float = SINGLE_CASE_SECONDS_THRESHOLD,
+                 max_open_cases: int = DEFAULT_MAX_OPEN_CASES):
+        self.ttl_seconds = ttl_seconds
+        self.max_open_cases = max_open_cases
+        # Cases are ordered by the time of last event - the oldest are first
+        self.cases = OrderedDict()
+        self.clock = None
+        self.processed = 0
+        self.emitted = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.cases)
+
+    def process_event(self, event: PredictionEvent) -> Optional[dict]:
+        """ Update state with new event. Return arrival record if the case is finished by the event """
+        self.processed += 1
+        if self.clock is None or event.request_time > self.clock:
+            self.clock = event.request_time
+            self._evict_expired()
+        # Skip non reliable data (as in batch processing)
+        if event.tmId == 0:
+            return None
+
+        key = (event.route_path_id, event.stop_id, event.tmId)
+        case = self.cases.get(key)
+        if not event.byTelemetry:
+            if case is None or event.forecast_time - case.max_scheduled_time >= SINGLE_CASE_SECONDS_THRESHOLD:
+                case = OpenCase(event.forecast_time, self.clock)
+                self.cases[key] = case
+                self._evict_overflow()
+            elif not case.is_arrived:
+                case.scheduled_sum += event.forecast_time
+                case.scheduled_count += 1
+                case.max_scheduled_time = max(case.max_scheduled_time, event.forecast_time)
+            self._touch(key, case)
+            return None
+
+        if case is None or case.is_arrived:
+            return None
+        self._touch(key, case)
+        horizon = abs(event.forecast_time - event.request_time)
+        if horizon >= MIN_FORECAST_HORIZON_SECONDS or \
+                abs(event.forecast_time - case.scheduled_time) >= CASE_SECONDS_TEL_THRESHOLD:
+            return None
+
+        case.is_arrived = True
+        self.emitted += 1
+        return {'route_path_id': event.route_path_id, 'stop_id': event.stop_id, 'tmId': event.tmId,
+                'forecast_time': case.scheduled_time, 'arrival_time': event.forecast_time,
+                'request_time': event.request_time, 'scheduled_count': case.scheduled_count}
+
+    def _touch(self, key: tuple, case: OpenCase):
+        case.last_seen = self.clock
+        self.cases.move_to_end(key)
+
+    def _evict_expired(self):
+        while len(self.cases) > 0:
+            key, case = next(iter(self.cases.items()))
+            if case.last_seen > self.clock - self.ttl_seconds:
+                break
+            del self.cases[key]
+            self.evicted += 1
+
+    def _evict_overflow(self):
+        while len(self.cases) > self.max_open_cases:
+            self.cases.popitem(last=False)
+            self.evicted += 1
+
+
+def parse_event(line: str) -> PredictionEvent:
+    """ Parse single line of pred_data.csv (without header) """
+    values = line.rstrip('\r\n').split(',')
+    return PredictionEvent(int(values[0]), values[1], values[2], int(float(values[3])),
+                           values[4] in ('1', 'True', 'true', '1.0'), int(float(values[5])),
+                           values[6], int(float(values[7])))
+
+
+async def consume_events(estimator: LiveArrivalEstimator, events: AsyncIterator[PredictionEvent],
+                         on_arrival: Callable[[dict], None]):
+    """ Pass events to the estimator and arrival records to on_arrival callback """
+    async for event in events:
+        record = estimator.process_event(event)
+        if record is not None:
+            on_arrival(record)
+
+
+async def iterate_queue(queue: asyncio.Queue) -> AsyncIterator[PredictionEvent]:
+    """ Events from in-process queue. None in the queue finishes iteration """
+    while True:
+        event = await queue.get()
+        if event is None:
+            return
+        yield event
+
+
+async def tail_file(csv_path: Union[Path, str], follow: bool = True,
+                    poll_seconds: float = TAIL_POLL_SECONDS) -> AsyncIterator[PredictionEvent]:
+    """
+    Events from csv file which is appended by another process. Incomplete
+    last line is read again when it is finished. If follow is False -
+    iteration stops at the end of file
+    """
+    with open(csv_path, 'r') as f:
+        n_lines = 0
+        while True:
+            position = f.tell()
+            line = f.readline()
+            if not line.endswith('\n'):
+                # End of file or line which is still being written
+                f.seek(position)
+                if not follow:
+                    return
+                await asyncio.sleep(poll_seconds)
+                continue
+
+            yield parse_event(line)
+            n_lines += 1
+            if n_lines % READ_BATCH_LINES == 0:
+                await asyncio.sleep(0)
+
+
+async def read_stream(reader: asyncio.StreamReader) -> AsyncIterator[PredictionEvent]:
+    """ Events from socket connection (one line of pred_data.csv per event) """
+    async for line in reader:
+        yield parse_event(line.decode('utf-8'))
+
+
+async def serve_socket(estimator: LiveArrivalEstimator, on_arrival: Callable[[dict], None],
+                       host: str = '127.0.0.1', port: int = 8766) -> asyncio.AbstractServer:
+    """
+    Rus
+    Запускает TCP сервер, который принимает события журнала прогнозов
+    (строки в формате pred_data.csv) и передает их в estimator. Все
+    подключения используют общее состояние кейсов
+
+    :param estimator: streaming estimator
+    :param on_arrival: callback for arrival records
+    :param host: host to listen
+    :param port: port to listen (0 means any free port)
+    """
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await consume_events(estimator, read_stream(reader), on_arrival)
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle_connection, host, port)
+    logger.info(f'Listen prediction events on {host}:{server.sockets[0].getsockname()[1]}')
+    return server
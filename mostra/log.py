@@ -0,0 +1,76 @@
+import logging
+import os
+from typing import Iterable, Union
+
+from tqdm import tqdm
+
+import warnings
+warnings.filterwarnings('ignore')
+
+# Settings are also passed to worker processes started with "spawn"
+LOG_LEVEL_ENV = 'MOSTRA_LOG_LEVEL'
+QUIET_ENV = 'MOSTRA_QUIET'
+PACKAGE_LOGGER_NAME = 'mostra'
+
+_SETTINGS = {'quiet': False}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """ Return logger inside the package logger hierarchy (module name is expected) """
+    if not name.startswith(PACKAGE_LOGGER_NAME):
+        name = f'{PACKAGE_LOGGER_NAME}.{name}'
+    return logging.getLogger(name)
+
+
+def configure_logging(level: Union[int, str] = logging.INFO, quiet: bool = False):
+    """
+    Rus
+    Настраивает вывод сообщений и индикаторов прогресса. Сообщения о
+    каждом маршруте выводятся только на уровне DEBUG, на уровне INFO для
+    каждого этапа обработки показывается один общий индикатор прогресса.
+    В тихом режиме выводятся только предупреждения и ошибки. Без вызова
+    этой функции пакет не добавляет своих обработчиков сообщений (они
+    передаются в настройки logging приложения)
+
+    :param level: logging level for the package messages
+    :param quiet: if True - progress bars are disabled and only warnings
+    and errors are shown
+    """
+    level = logging.getLevelName(level) if isinstance(level, int) else level.upper()
+    os.environ[LOG_LEVEL_ENV] = level
+    os.environ[QUIET_ENV] = '1' if quiet else '0'
+    _apply_settings(level, quiet)
+
+
+def is_quiet() -> bool:
+    return _SETTINGS['quiet']
+
+
+def progress(iterable: Iterable, description: str, total: int = None) -> Iterable:
+    """
+    Wrap iterable with single progress bar for the stage. Bar is not shown in
+    quiet mode or if INFO messages of the package are disabled explicitly
+    """
+    logger = logging.getLogger(PACKAGE_LOGGER_NAME)
+    is_disabled = is_quiet() or (logger.level != logging.NOTSET and not logger.isEnabledFor(logging.INFO))
+    return tqdm(iterable, desc=description, total=total, colour='blue', disable=is_disabled)
+
+
+def _apply_settings(level: str, quiet: bool):
+    logger = logging.getLogger(PACKAGE_LOGGER_NAME)
+    if not any(not isinstance(handler, logging.NullHandler) for handler in logger.handlers):
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+
+    logger.setLevel(logging.WARNING if quiet else level)
+    _SETTINGS['quiet'] = quiet
+
+
+# Library does not output anything by itself until configure_logging is
+# called. Settings are applied at import only in worker processes of the
+# application which called configure_logging (see LOG_LEVEL_ENV)
+logging.getLogger(PACKAGE_LOGGER_NAME).addHandler(logging.NullHandler())
+if LOG_LEVEL_ENV in os.environ:
+    _apply_settings(os.environ[LOG_LEVEL_ENV].upper(), os.environ.get(QUIET_ENV) == '1')
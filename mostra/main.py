@@ -1,168 +1,283 @@
 from pathlib import Path
-from typing import Union
+from typing import List, Optional, Union
 
 import pandas as pd
 import numpy as np
 
-from tqdm import tqdm
-
-from mostra.paths import create_folder, get_data_path
+from mostra.catalog import StopCatalog, get_stop_catalog
+from mostra.ids import get_id_dictionary
+from mostra.instrumentation import track_stage
+from mostra.log import get_logger, progress
+from mostra.parallel import get_route_path_ids, imap_in_parallel, split_by_routes
+from mostra.paths import create_folder
+from mostra.topology import RouteTopology, get_route_topology, infer_route_topology
 
 import warnings
 
 from mostra.plots import create_plot_with_stops, COLORS_PER_TRANSPORT, \
-    create_plot_with_stops_and_transport
+    create_plot_with_stops_and_transport, get_plot_name, PLOT_DPI
 
 warnings.filterwarnings('ignore')
 
+logger = get_logger(__name__)
+
 
 class TransportDataExplorer:
     """
     Class for exploring transport data, creating visualizations and
-    perform preprocessing
+    perform preprocessing. Plots are rendered in worker processes - only
+    paths to saved files are returned to the main process
+
+    :param dataframe: table with transport data
+    :param n_jobs: number of processes to prepare and render routes in
+    parallel. -1 means all available cores
+    :param catalog: catalog of stops and routes. If None - catalog is loaded
+    from stop_from_repo.csv
+    :param data_path: path to the file with transport data. If defined -
+    plots which are newer than the file are not rendered again
+    :param dpi: resolution of saved plots
+    :param topology_path: path to csv file with cached stops order for routes
+    (see mostra.topology). If None and data_path is defined - file
+    "<data file name>_route_topology.csv" next to the data file is used
     """
 
-    def __init__(self, dataframe: pd.DataFrame):
+    def __init__(self, dataframe: pd.DataFrame, n_jobs: int = 1,
+                 catalog: Optional[StopCatalog] = None,
+                 data_path: Union[Path, str] = None,
+                 dpi: int = PLOT_DPI,
+                 topology_path: Union[Path, str] = None):
         self.dataframe = dataframe
+        self.n_jobs = n_jobs
+        if catalog is None:
+            catalog = get_stop_catalog()
+        self.catalog = catalog
+        self.data_path = data_path
+        self.dpi = dpi
+        if topology_path is None and data_path is not None:
+            data_path = Path(data_path)
+            topology_path = Path(data_path.parent, f'{data_path.stem}_route_topology.csv')
+        self.topology_path = topology_path
+        self._topology = None
+
+    @property
+    def topology(self) -> RouteTopology:
+        """ Stops order for all routes. Inferred once and reused by all plots """
+        if self._topology is None:
+            self._topology = get_route_topology(self.dataframe, self.topology_path, self.data_path)
+        return self._topology
+
+    @staticmethod
+    def load_stops_info():
+        """
+        Load and return dataframes with information about stops (stop_id,
+        name) and routes (route_path_id, transport_type, number).
+        Deprecated - use get_stop_catalog() instead
+        """
+        warnings.warn('load_stops_info is deprecated, use get_stop_catalog() instead',
+                      DeprecationWarning, stacklevel=2)
+        catalog = get_stop_catalog()
+        stop_names = catalog.stops[['name']].reset_index()
+        routes_names = catalog.routes.reset_index()
+        return stop_names, routes_names
 
-    def prepare_plots_stops_per_route(self, folder_to_save: Union[Path, str]):
+    def prepare_plots_stops_per_route(self, folder_to_save: Union[Path, str]) -> List[Path]:
         """
         Rus
         Генерирует графики где приезд транспортных средств упорядочен по времени для
         выбранных остановок. Остановки также упорядочены снизу вверх в порядке
-        движения транспорта по маршруту
-
-        TODO Выяснить есть ли более надежный способ задавать порядок остановок. В
-            production решении они должны определяться однозначно из базы данных
+        движения транспорта по маршруту (порядок определяется по всем
+        транспортным средствам, см. mostra.topology)
         """
-        folder_to_save = create_folder(folder_to_save)
-        stop_names, routes_names = self.load_stops_info()
+        return self._render_routes(render_stops_per_route, folder_to_save)
 
-        route_path_ids = list(self.dataframe['route_path_id'].unique())
-        route_path_ids.sort()
+    def prepare_plots_track_transport(self, folder_to_save: Union[Path, str]) -> List[Path]:
+        return self._render_routes(render_track_transport, folder_to_save)
 
-        for route_name, df_vis, tm_id_df, stops_order, transport_i in self._preprocess_dataframe_for_vis(route_path_ids,
-                                                                                                         stop_names,
-                                                                                                         routes_names):
-            # Generate plot
-            create_plot_with_stops(route_name, stops_order, df_vis,
-                                   tm_id_df, folder_to_save, transport_i)
-
-    def prepare_plots_track_transport(self, folder_to_save: Union[Path, str]):
+    def _render_routes(self, render_func, folder_to_save: Union[Path, str]) -> List[Path]:
+        """ Render plot for each route in worker processes. Return paths to new plots """
         folder_to_save = create_folder(folder_to_save)
-        stop_names, routes_names = self.load_stops_info()
-
-        route_path_ids = list(self.dataframe['route_path_id'].unique())
-        route_path_ids.sort()
-
-        for route_name, df_vis, tm_id_df, stops_order, transport_i in self._preprocess_dataframe_for_vis(route_path_ids,
-                                                                                                         stop_names,
-                                                                                                         routes_names):
-            if len(list(df_vis['tmId'].unique())) > len(COLORS_PER_TRANSPORT):
-                continue
-
-            create_plot_with_stops_and_transport(route_name, stops_order,
-                                                 df_vis, folder_to_save)
-
-    def _preprocess_dataframe_for_vis(self, route_path_ids: list,
-                                      stop_names: pd.DataFrame,
-                                      routes_names: pd.DataFrame):
-        for route_path_id in route_path_ids:
-            print(f'Create plot for route {route_path_id}')
-
-            route_df = self.dataframe[self.dataframe['route_path_id'] == route_path_id]
-
-            # Prepare dataframe for visualization
-            try:
-                df_vis, route_path_name = enrich_with_route_stop_name(route_df,
-                                                                      route_path_id,
-                                                                      stop_names,
-                                                                      routes_names)
-            except Exception as ex:
-                # Skip incorrect cases
-                print(f'Skip {route_path_id} due to {ex}')
-                continue
-
-            grouped_by_transport = df_vis.groupby('tmId').agg({'stop_name': 'count'})
-            grouped_by_transport = grouped_by_transport.reset_index()
-            grouped_by_transport['tmId'] = grouped_by_transport['tmId'].replace({0: np.nan})
-            grouped_by_transport = grouped_by_transport.dropna()
-            grouped_by_transport = grouped_by_transport.reset_index()
-
-            if len(grouped_by_transport) < 2:
-                continue
-
-            max_id = np.argmax(np.array(grouped_by_transport['stop_name']))
-            transport_to_check = grouped_by_transport['tmId'].iloc[max_id]
-
-            ######################################
-            # Search for appropriate stops order #
-            ######################################
-            tm_id_df = df_vis[df_vis['tmId'] == transport_to_check]
-            tm_id_df = tm_id_df[tm_id_df['byTelemetry'] == 0]
-            if len(tm_id_df['stop_name'].unique()) != len(
-                    df_vis['stop_name'].unique()):
-                print(f'We can miss several stops during analysis - skip current route_path_id')
-                continue
-            tm_id_df = tm_id_df.sort_values(by='forecast_time_datetime')
-            stops_order = list(tm_id_df['stop_name'].unique())
-
-            yield route_path_name, df_vis, tm_id_df, stops_order, transport_to_check
-
-    @staticmethod
-    def load_stops_info():
-        """ Load and return dataframe with information about stops """
-        stop_from_repo = pd.read_csv(Path(get_data_path(), 'stop_from_repo.csv'))
-        stop_names = stop_from_repo[['stop_id', 'name']]
-        stop_names = stop_names.drop_duplicates()
-
-        routes_names = stop_from_repo[['route_path_id', 'transport_type', 'number']]
-        routes_names = routes_names.drop_duplicates()
 
-        return stop_names, routes_names
-
-
-def enrich_with_route_stop_name(route_df: pd.DataFrame, route_path_id,
-                                stop_names, routes_names):
+        with track_stage('render', rows_in=len(self.dataframe)) as record:
+            # Plot names contain UUID of the route (also for integer codes)
+            route_path_ids = get_route_path_ids(self.dataframe)
+            plot_route_ids = dict(zip(route_path_ids, _decode_route_path_ids(route_path_ids)))
+            route_path_ids = [route_path_id for route_path_id in route_path_ids
+                              if not self._is_plot_up_to_date(route_path_id, plot_route_ids[route_path_id],
+                                                              folder_to_save)]
+            # Tables of routes are created only when they are sent to
+            # workers together with the stops order of the route
+            topology = self.topology
+            route_items = ((route_df, topology.for_route(route_path_id), plot_route_ids[route_path_id])
+                           for route_path_id, route_df
+                           in zip(route_path_ids, split_by_routes(self.dataframe, route_path_ids)))
+            plot_paths = imap_in_parallel(render_route, route_items, self.n_jobs, render_func=render_func,
+                                          catalog=self.catalog, folder_to_save=folder_to_save, dpi=self.dpi)
+            plot_paths = progress(plot_paths, 'Render route plots', total=len(route_path_ids))
+            plot_paths = [plot_path for plot_path in plot_paths if plot_path is not None]
+            # Number of saved plots
+            record['rows_out'] = len(plot_paths)
+        return plot_paths
+
+    def _is_plot_up_to_date(self, route_path_id, plot_route_id, folder_to_save: Path) -> bool:
+        """ Check if plot for the route was saved after the data file modification """
+        if self.data_path is None:
+            return False
+        try:
+            route_path_name = self.catalog.route_name(route_path_id)
+        except KeyError:
+            return False
+
+        plot_path = Path(folder_to_save, get_plot_name(route_path_name, plot_route_id))
+        if not plot_path.is_file():
+            return False
+        return plot_path.stat().st_mtime > Path(self.data_path).stat().st_mtime
+
+
+def _decode_route_path_ids(route_path_ids: list) -> list:
+    """ Return UUID of routes (integer codes are decoded, see mostra.ids) """
+    if len(route_path_ids) > 0 and isinstance(route_path_ids[0], (int, np.integer)):
+        return list(get_id_dictionary().decode(route_path_ids))
+    return list(route_path_ids)
+
+
+def render_route(route_item: tuple, render_func, **kwargs) -> Optional[Path]:
+    """ Call render function for (route table, topology of the route, route UUID for plot name) """
+    route_df, topology, plot_route_id = route_item
+    return render_func(route_df, topology=topology, plot_route_id=plot_route_id, **kwargs)
+
+
+def render_stops_per_route(route_df: pd.DataFrame, catalog: StopCatalog,
+                           folder_to_save: Path, dpi: int = PLOT_DPI,
+                           topology: Optional[RouteTopology] = None,
+                           plot_route_id=None) -> Optional[Path]:
     """
-    Rus
-    Дополняет данные названиями остановок и названиями маршрутов
+    Prepare route data and save plot with stops. Return path to plot or None.
+    plot_route_id is added to the plot name (route_path_id if None)
     """
-    # Iterate through stops
-    stop_ids = list(route_df['stop_id'].unique())
-    stop_ids.sort()
+    prepared_route = prepare_route_for_vis(route_df, catalog, topology)
+    if prepared_route is None:
+        return None
 
-    pbar = tqdm(stop_ids, colour='blue')
+    route_name, df_vis, tm_id_df, stops_order, transport_i = prepared_route
+    return create_plot_with_stops(route_name, stops_order, df_vis,
+                                  tm_id_df, folder_to_save, transport_i, dpi=dpi,
+                                  route_path_id=_get_plot_route_id(route_df, plot_route_id))
 
-    df_vis = []
-    route_path_name = 'default'
-    for stop_id in pbar:
-        pbar.set_description(f'Enrich {route_path_id} with {stop_id}')
 
-        stop_df = route_df[route_df['stop_id'] == stop_id]
-        if len(stop_df) < 1:
-            continue
+def render_track_transport(route_df: pd.DataFrame, catalog: StopCatalog,
+                           folder_to_save: Path, dpi: int = PLOT_DPI,
+                           topology: Optional[RouteTopology] = None,
+                           plot_route_id=None) -> Optional[Path]:
+    """
+    Prepare route data and save plot with stops and transport. Return path
+    to plot or None. plot_route_id is added to the plot name (route_path_id
+    if None)
+    """
+    prepared_route = prepare_route_for_vis(route_df, catalog, topology)
+    if prepared_route is None:
+        return None
 
-        stop_names_local = stop_names[stop_names['stop_id'] == stop_id]
-        stop_name = stop_names_local['name'].iloc[0]
+    route_name, df_vis, _, stops_order, _ = prepared_route
+    if len(list(df_vis['tmId'].unique())) > len(COLORS_PER_TRANSPORT):
+        return None
+    return create_plot_with_stops_and_transport(route_name, stops_order,
+                                                df_vis, folder_to_save, dpi=dpi,
+                                                route_path_id=_get_plot_route_id(route_df, plot_route_id))
 
-        # Add columns for convenient debug checking
-        stop_df['forecast_time_datetime'] = pd.to_datetime(stop_df['forecast_time'], unit='s')
-        stop_df['request_time_datetime'] = pd.to_datetime(stop_df['request_time'], unit='s')
-        stop_df = stop_df.sort_values(by=['request_time_datetime', 'forecast_time_datetime'])
 
-        stop_df = stop_df.merge(routes_names, on='route_path_id')
-        stop_df = stop_df.drop_duplicates()
-        transport_type = stop_df['transport_type'].iloc[0]
-        number = stop_df['number'].iloc[0]
-        route_path_name = f'{transport_type} {number}'
+def _get_plot_route_id(route_df: pd.DataFrame, plot_route_id=None):
+    return route_df['route_path_id'].iloc[0] if plot_route_id is None else plot_route_id
 
-        stop_df['stop_name'] = [stop_name] * len(stop_df)
 
-        df_vis.append(stop_df)
+def prepare_route_for_vis(route_df: pd.DataFrame, catalog: StopCatalog,
+                          topology: Optional[RouteTopology] = None):
+    """
+    Rus
+    Подготавливает данные одного маршрута для визуализации: добавляет
+    названия остановок и определяет порядок остановок на маршруте (по
+    topology, если маршрута там нет - порядок определяется по данным
+    маршрута). Если маршрут не подходит для визуализации, то возвращается None
+    """
+    route_path_id = route_df['route_path_id'].iloc[0]
+    logger.debug(f'Create plot for route {route_path_id}')
+
+    # Prepare dataframe for visualization
+    try:
+        df_vis, route_path_name = enrich_with_route_stop_name(route_df,
+                                                              route_path_id,
+                                                              catalog)
+    except Exception as ex:
+        # Skip incorrect cases
+        logger.warning(f'Skip {route_path_id} due to {ex!r}')
+        return None
+
+    grouped_by_transport = df_vis.groupby('tmId').agg({'stop_name': 'count'})
+    grouped_by_transport = grouped_by_transport.reset_index()
+    grouped_by_transport['tmId'] = grouped_by_transport['tmId'].replace({0: np.nan})
+    grouped_by_transport = grouped_by_transport.dropna()
+    grouped_by_transport = grouped_by_transport.reset_index()
+
+    if len(grouped_by_transport) < 2:
+        return None
+
+    max_id = np.argmax(np.array(grouped_by_transport['stop_name']))
+    transport_to_check = grouped_by_transport['tmId'].iloc[max_id]
+    tm_id_df = df_vis[df_vis['tmId'] == transport_to_check]
+    tm_id_df = tm_id_df[tm_id_df['byTelemetry'] == 0]
+    tm_id_df = tm_id_df.sort_values(by='forecast_time_datetime')
+
+    ######################################
+    # Search for appropriate stops order #
+    ######################################
+    if topology is None or len(topology.stops_order(route_path_id)) < 1:
+        topology = infer_route_topology(route_df)
+    # Several stops can have the same name
+    stops_order = list(dict.fromkeys(catalog.stop_name(stop_id)
+                                     for stop_id in topology.stops_order(route_path_id)))
+    if len(stops_order) != len(df_vis['stop_name'].unique()):
+        logger.debug(f'We can miss several stops during analysis - skip route {route_path_id}')
+        return None
+    logger.debug(f'Stops order confidence for route {route_path_id}: {topology.confidence(route_path_id)}')
+
+    return route_path_name, df_vis, tm_id_df, stops_order, transport_to_check
 
-    df_vis = pd.concat(df_vis)
-    route_path_name = route_path_name.replace('bus', 'Автобус')
-    route_path_name = route_path_name.replace('tram', 'Трамвай')
 
+def enrich_with_route_stop_name(route_df: pd.DataFrame, route_path_id,
+                                catalog: StopCatalog):
+    """
+    Rus
+    Дополняет данные названиями остановок и названиями маршрутов. Если
+    маршрута или какой-либо остановки нет в справочнике, то возникает
+    KeyError. Строки упорядочены по остановкам, а внутри остановки - по
+    времени запроса и прогнозному времени. Повторяющиеся строки удаляются.
+    Таблица формируется за одну выборку строк без промежуточных копий для
+    каждой остановки
+    """
+    transport_type, number = catalog.route_info(route_path_id)
+    route_path_name = catalog.route_name(route_path_id)
+
+    # Names are looked up once per unique stop and then mapped by codes
+    stop_codes, stop_ids = pd.factorize(route_df['stop_id'])
+    if (stop_codes < 0).any():
+        raise KeyError('Missing stop_id')
+    stop_ids = np.asarray(stop_ids)
+    stop_names = catalog.stops['name'].loc[stop_ids].to_numpy()
+
+    # Rows are ordered by stop, request time and forecast time (stable sort)
+    stop_ranks = np.empty(len(stop_ids), dtype=np.int64)
+    stop_ranks[np.argsort(stop_ids, kind='stable')] = np.arange(len(stop_ids))
+    order = np.lexsort((route_df['forecast_time'].to_numpy(),
+                        route_df['request_time'].to_numpy(),
+                        stop_ranks[stop_codes]))
+    # Duplicates are equal in sort keys, so the first one stays first after sorting
+    is_duplicated = route_df.duplicated().to_numpy()
+    order = order[~is_duplicated[order]]
+
+    df_vis = route_df.take(order)
+    # Add columns for convenient debug checking
+    df_vis['forecast_time_datetime'] = pd.to_datetime(df_vis['forecast_time'], unit='s')
+    df_vis['request_time_datetime'] = pd.to_datetime(df_vis['request_time'], unit='s')
+    df_vis['transport_type'] = transport_type
+    df_vis['number'] = number
+    df_vis['stop_name'] = stop_names[stop_codes[order]]
     return df_vis, route_path_name
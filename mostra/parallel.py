@@ -0,0 +1,124 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Sequence
+
+import pandas as pd
+
+from mostra.log import progress
+
+# Function and shared arguments of the worker process (see _init_worker)
+_WORKER_TASK = {}
+
+
+def get_n_jobs(n_jobs: int) -> int:
+    """ Return number of worker processes. -1 means all available cores """
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        return max(os.cpu_count() + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def imap_in_parallel(func: Callable, items: Iterable, n_jobs: int = 1, **kwargs) -> Iterator:
+    """
+    Apply function to each item using pool of processes. Results are
+    returned in the same order as items
+
+    :param func: function to apply (must be defined on module level)
+    :param items: objects to process (list or lazy iterable). Each item is
+    sent to worker separately, so it should be as small as possible
+    :param n_jobs: number of worker processes. -1 means all available cores
+    :param kwargs: additional arguments which are the same for all items.
+    They are sent to each worker process only once
+    """
+    n_jobs = get_n_jobs(n_jobs)
+    if isinstance(items, Sequence):
+        n_jobs = min(n_jobs, max(len(items), 1))
+    if n_jobs == 1:
+        for item in items:
+            yield func(item, **kwargs)
+        return
+
+    # Only a few tasks are submitted in advance so finished results (and
+    # items from lazy iterable) do not pile up in memory when the consumer
+    # is slower than workers
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                             initargs=(func, kwargs)) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(_run_worker_task, item))
+            if len(pending) >= n_jobs * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _init_worker(func: Callable, kwargs: dict):
+    _WORKER_TASK['func'] = func
+    _WORKER_TASK['kwargs'] = kwargs
+
+
+def _run_worker_task(item):
+    return _WORKER_TASK['func'](item, **_WORKER_TASK['kwargs'])
+
+
+def run_in_parallel(func: Callable, items: Iterable, n_jobs: int = 1,
+                    show_progress: bool = True, total: int = None, **kwargs) -> List:
+    """
+    Apply function to each item and return list with results in items order.
+    Nested calls (inside other stage) should not show progress bar. total is
+    the number of items for progress bar if items is lazy iterable
+    """
+    results = imap_in_parallel(func, items, n_jobs, **kwargs)
+    if not show_progress:
+        return list(results)
+    if total is None and isinstance(items, Sequence):
+        total = len(items)
+    # Single progress bar for all items
+    return list(progress(results, func.__name__, total=total))
+
+
+def get_route_path_ids(df: pd.DataFrame) -> list:
+    """ Return sorted list of route_path_id values in the table """
+    return sorted(df['route_path_id'].dropna().unique())
+
+
+def split_by_routes(df: pd.DataFrame, route_path_ids: Iterable = None) -> Iterator[pd.DataFrame]:
+    """
+    Yield separate table for each route_path_id (sorted by route_path_id).
+    Tables are created one by one when they are requested
+
+    :param df: table with route_path_id column
+    :param route_path_ids: routes to yield tables for. If None - all routes
+    """
+    positions = df.groupby('route_path_id', sort=False, observed=True).indices
+    if route_path_ids is None:
+        route_path_ids = sorted(positions)
+    for route_path_id in route_path_ids:
+        yield df.iloc[positions[route_path_id]]
+
+
+def apply_per_route(func: Callable, df: pd.DataFrame, n_jobs: int = 1,
+                    show_progress: bool = True, **kwargs) -> pd.DataFrame:
+    """
+    Rus
+    Применяет функцию к данным каждого маршрута (route_path_id) отдельно и
+    объединяет результаты в порядке сортировки маршрутов. Маршруты
+    обрабатываются параллельно - в каждый процесс отправляется только часть
+    таблицы, относящаяся к маршруту
+
+    :param func: function which takes table for one route and returns table
+    (or None if there are no results for the route)
+    :param df: table with route_path_id column
+    :param n_jobs: number of worker processes. -1 means all available cores
+    :param show_progress: show progress bar. Should be False for nested calls
+    :param kwargs: additional arguments for function
+    """
+    route_path_ids = get_route_path_ids(df)
+    results = run_in_parallel(func, split_by_routes(df, route_path_ids), n_jobs, show_progress,
+                              total=len(route_path_ids), **kwargs)
+    results = [result for result in results if result is not None and len(result) > 0]
+    if len(results) < 1:
+        return pd.DataFrame()
+    return pd.concat(results)
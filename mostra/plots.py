@@ -5,7 +5,8 @@ from typing import Any
 import pandas as pd
 import numpy as np
 
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import warnings
 
 from mostra.data_structure import MIN_FORECAST_HORIZON_SECONDS
@@ -19,6 +20,31 @@ COLORS_PER_TRANSPORT = ['red', 'orange', 'green', 'blue', 'black',
                         'purple', 'purple', 'purple', 'purple', 'purple',
                         'purple', 'purple', 'purple', 'purple', 'purple',
                         'purple', 'purple', 'purple', 'purple', 'purple']
+PLOT_DPI = 300
+
+
+def get_plot_name(route_path_name: str, route_path_id=None) -> str:
+    """
+    Return name of png file for the route. Both directions of the route have
+    the same name, so route_path_id (UUID) is added to the file name
+    """
+    plot_name = route_path_name.replace(".", "_")
+    if route_path_id is None:
+        return f'{plot_name}.png'
+    return f'{plot_name}_{route_path_id}.png'
+
+
+def get_stop_positions(df_vis: pd.DataFrame, stops_order: list) -> np.ndarray:
+    """ Return position of each row stop in stops_order (-1 for stops which are not in the list) """
+    return np.array(pd.Categorical(df_vis['stop_name'], categories=stops_order).codes)
+
+
+def _keep_repeated_positions(mask: np.ndarray, positions: np.ndarray, n_positions: int) -> np.ndarray:
+    """ Keep rows from mask only for positions with more than one selected row """
+    mask = mask & (positions >= 0)
+    counts = np.bincount(positions[mask], minlength=n_positions)
+    mask[mask] = counts[positions[mask]] > 1
+    return mask
 
 
 def create_plot_with_stops(route_path_name: str,
@@ -26,23 +52,26 @@ def create_plot_with_stops(route_path_name: str,
                            df_vis: pd.DataFrame,
                            tm_id_df: pd.DataFrame,
                            folder_to_save: Path,
-                           transport_to_check: Any):
+                           transport_to_check: Any,
+                           dpi: int = PLOT_DPI,
+                           route_path_id=None):
     fig_size = (15, 10.0)
-    fig, ax = plt.subplots(1, figsize=fig_size)
-    for i, stop in enumerate(stops_order):
-        stop_df = df_vis[df_vis['stop_name'] == stop]
-        stop_df = stop_df.sort_values(by='forecast_time_datetime')
-
-        tel_data = stop_df[stop_df['byTelemetry'] == 1]
-        scheduled_data = stop_df[stop_df['byTelemetry'] == 0]
-
-        if len(tel_data) > 1:
-            ax.scatter(tel_data['forecast_time_datetime'], [i] * len(tel_data),
-                       c='red', alpha=0.8, s=50, edgecolors={'#FFBAAC'})
-        if len(scheduled_data) > 1:
-            ax.scatter(scheduled_data['forecast_time_datetime'],
-                       [i] * len(scheduled_data),
-                       c='blue', alpha=0.8, s=50, edgecolors={'#BCE7FF'})
+    # Object-oriented API with Agg canvas - no global pyplot state, so
+    # plots can be rendered in worker processes
+    fig = Figure(figsize=fig_size)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots(1)
+    positions = get_stop_positions(df_vis, stops_order)
+    is_telemetry = np.array(df_vis['byTelemetry'] == 1)
+    forecast_time = df_vis['forecast_time_datetime']
+
+    # Single items of the series on the stop are not shown
+    tel_mask = _keep_repeated_positions(is_telemetry, positions, len(stops_order))
+    ax.scatter(forecast_time[tel_mask], positions[tel_mask],
+               c='red', alpha=0.8, s=50, edgecolors='#FFBAAC')
+    scheduled_mask = _keep_repeated_positions(~is_telemetry, positions, len(stops_order))
+    ax.scatter(forecast_time[scheduled_mask], positions[scheduled_mask],
+               c='blue', alpha=0.8, s=50, edgecolors='#BCE7FF')
 
     # Add line for desired (main) transport
     agg = tm_id_df.groupby('stop_name').agg({'forecast_time_datetime': 'first'})
@@ -63,52 +92,46 @@ def create_plot_with_stops(route_path_name: str,
         ax.set_xlim(min_x, max_x)
 
     ax.grid()
+    ax.set_yticks(range(len(stops_order)))
     ax.set_yticklabels(stops_order)
-    plt.yticks(range(len(stops_order)))
     ax.legend(fontsize=16)
     ax.set_xlabel('Дата')
     ax.set_ylabel('Остановки на маршруте')
     fig.suptitle(f'Маршрут {route_path_name}', fontsize=16)
-    plot_name = f'{route_path_name.replace(".", "_")}.png'
-    fig.savefig(Path(folder_to_save, plot_name),
-                dpi=300, bbox_inches='tight')
-    plt.close()
+    plot_path = Path(folder_to_save, get_plot_name(route_path_name, route_path_id))
+    fig.savefig(plot_path, dpi=dpi, bbox_inches='tight')
+    return plot_path
 
 
 def create_plot_with_stops_and_transport(route_path_name: str,
                                          stops_order: list,
                                          df_vis: pd.DataFrame,
-                                         folder_to_save: Path):
+                                         folder_to_save: Path,
+                                         dpi: int = PLOT_DPI,
+                                         route_path_id=None):
     fig_size = (15, 10.0)
-    fig, ax = plt.subplots(1, figsize=fig_size)
-    for transport_id, transport in enumerate(list(df_vis['tmId'].unique())):
-        transport_df = df_vis[df_vis['tmId'] == transport]
-        color = COLORS_PER_TRANSPORT[transport_id]
-
-        for i, stop in enumerate(stops_order):
-            stop_df = transport_df[transport_df['stop_name'] == stop]
-            stop_df = stop_df.sort_values(by='forecast_time_datetime')
-
-            tel_data = stop_df[stop_df['byTelemetry'] == 1]
-            scheduled_data = stop_df[stop_df['byTelemetry'] == 0]
-
-            if len(tel_data) >= 1:
-                # Remove all unreliable telemetry data (use threshold for that)
-                if 'id' in list(tel_data.columns):
-                    tel_data = tel_data.drop(columns=['id'])
-                tel_data['diff'] = tel_data['forecast_time'] - tel_data['request_time']
-                tel_data['diff'] = np.abs(np.array(tel_data['diff']))
-                tel_data['diff'][tel_data['diff'] > MIN_FORECAST_HORIZON_SECONDS] = np.nan
-                tel_data = tel_data.dropna()
-
-                if len(tel_data) >= 1:
-                    ax.scatter(tel_data['forecast_time_datetime'],
-                               [i] * len(tel_data),
-                               c=color, alpha=1.0, marker="^", s=110)
-            if len(scheduled_data) >= 1:
-                ax.scatter(scheduled_data['forecast_time_datetime'],
-                           [i] * len(scheduled_data),
-                           c=color, alpha=0.5, s=110)
+    fig = Figure(figsize=fig_size)
+    FigureCanvasAgg(fig)
+    ax = fig.subplots(1)
+    # Points are drawn in order of transport appearance - the same layers as
+    # with separate scatter call per transport
+    transport_codes = pd.factorize(df_vis['tmId'])[0]
+    df_vis = df_vis.iloc[np.argsort(transport_codes, kind='stable')]
+    colors = np.array(COLORS_PER_TRANSPORT)[np.sort(transport_codes, kind='stable')]
+
+    positions = get_stop_positions(df_vis, stops_order)
+    forecast_time = df_vis['forecast_time_datetime']
+    is_known_stop = positions >= 0
+    is_telemetry = np.array(df_vis['byTelemetry'] == 1)
+
+    # Remove all unreliable telemetry data (use threshold for that)
+    horizon = np.abs(np.array(df_vis['forecast_time'] - df_vis['request_time']))
+    tel_mask = is_known_stop & is_telemetry & (horizon <= MIN_FORECAST_HORIZON_SECONDS)
+    ax.scatter(forecast_time[tel_mask], positions[tel_mask],
+               c=colors[tel_mask], alpha=1.0, marker="^", s=110)
+    scheduled_mask = is_known_stop & ~is_telemetry
+    ax.scatter(forecast_time[scheduled_mask], positions[scheduled_mask],
+               c=colors[scheduled_mask], alpha=0.5, s=110)
 
     if route_path_name == 'Трамвай 21':
         min_x = datetime.datetime.strptime("24072022T13:30",
@@ -120,12 +143,11 @@ def create_plot_with_stops_and_transport(route_path_name: str,
         ax.set_xlim(min_x, max_x)
 
     ax.grid()
+    ax.set_yticks(range(len(stops_order)))
     ax.set_yticklabels(stops_order)
-    plt.yticks(range(len(stops_order)))
     ax.set_xlabel('Дата')
     ax.set_ylabel('Остановки на маршруте')
     fig.suptitle(f'Маршрут {route_path_name}', fontsize=16)
-    plot_name = f'{route_path_name.replace(".", "_")}.png'
-    fig.savefig(Path(folder_to_save, plot_name),
-                dpi=300, bbox_inches='tight')
-    plt.close()
+    plot_path = Path(folder_to_save, get_plot_name(route_path_name, route_path_id))
+    fig.savefig(plot_path, dpi=dpi, bbox_inches='tight')
+    return plot_path
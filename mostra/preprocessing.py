@@ -1,80 +1,76 @@
 import pandas as pd
 
+from mostra.instrumentation import instrumented
+from mostra.parallel import apply_per_route
+
 import warnings
 warnings.filterwarnings('ignore')
 
 
 SINGLE_CASE_SECONDS_THRESHOLD = 10 * 60
+CASE_KEYS = ['route_path_id', 'stop_id', 'tmId']
+
+
+def label_schedule_cases(scheduled_data: pd.DataFrame) -> pd.Series:
+    """
+    Rus
+    Присваивает идентификатор кейса каждой записи расписания. Таблица должна
+    быть отсортирована по (route_path_id, stop_id, tmId, forecast_time).
+    Новый кейс начинается для каждой новой тройки "маршрут - остановка -
+    транспорт" или если между соседними прогнозами прошло не менее
+    SINGLE_CASE_SECONDS_THRESHOLD секунд. Идентификаторы уникальны для всей
+    таблицы
+    """
+    time_diff = scheduled_data.groupby(CASE_KEYS, sort=False, observed=True)['forecast_time'].diff()
+    # First row of each group has no previous item - it is always a new case
+    new_case = time_diff.isna() | (time_diff >= SINGLE_CASE_SECONDS_THRESHOLD)
+    return new_case.cumsum()
 
 
-def aggregate_schedule_items(df: pd.DataFrame) -> pd.DataFrame:
+@instrumented('aggregate')
+def aggregate_schedule_items(df: pd.DataFrame, n_jobs: int = 1) -> pd.DataFrame:
     """
     Rus
     Функция для агрегации данных расписания по кейсам и затем их усреднение.
+    Данные телеметрии остаются без изменений (только для тех троек
+    "маршрут - остановка - транспорт", для которых есть данные расписания)
+
+    :param df: table with raw data (see COLUMN_NAMES)
+    :param n_jobs: number of processes to aggregate routes in parallel.
+    -1 means all available cores
     """
 
     # Assign datetime labels for convenient debugging process
     df['forecast_time_datetime'] = pd.to_datetime(df['forecast_time'], unit='s')
     df['request_time_datetime'] = pd.to_datetime(df['request_time'], unit='s')
 
-    final_df = []
-    route_path_ids = list(df['route_path_id'].unique())
-    route_path_ids.sort()
-    for i, path_id in enumerate(route_path_ids):
-        print(f'Process path {i} from {len(route_path_ids)}')
-        route_path_df = df[df['route_path_id'] == path_id]
-
-        stops_list = list(route_path_df['stop_id'].unique())
-        for stop in stops_list:
-            stop_df = route_path_df[route_path_df['stop_id'] == stop]
-
-            for transport_id in list(stop_df['tmId'].unique()):
-                transport_df = stop_df[stop_df['tmId'] == transport_id]
-
-                transponder_data = transport_df[transport_df['byTelemetry'] == 1]
-                if len(transponder_data) > 0:
-                    transponder_data = transponder_data.drop(columns=['id'])
-
-                scheduled_data = transport_df[transport_df['byTelemetry'] == 0]
-                if len(scheduled_data) < 1:
-                    continue
-                elif len(scheduled_data) == 1:
-                    final_df.extend([transponder_data, scheduled_data])
+    if n_jobs != 1:
+        # Routes are independent - process them separately
+        return apply_per_route(aggregate_schedule_items, df, n_jobs)
 
-                # Assign single arrival labels to
-                scheduled_data = scheduled_data.sort_values(by='forecast_time')
-                row_id = 0
-                current_time_batch = 0
-                time_batches = []
-                for _, row in scheduled_data.iterrows():
-                    if row_id == 0:
-                        # Skip first index
-                        row_id += 1
-                        time_batches.append(current_time_batch)
-                        continue
+    # Sort only once - all cases become contiguous blocks of rows
+    scheduled_data = df[df['byTelemetry'] == 0]
+    scheduled_data = scheduled_data.sort_values(by=CASE_KEYS + ['forecast_time'], kind='mergesort')
+    cases = label_schedule_cases(scheduled_data)
 
-                    prev_row = scheduled_data.iloc[row_id - 1]
-                    time_diff = row.forecast_time - prev_row.forecast_time
-                    # The time delta must not exceed 20 minutes
-                    if time_diff >= SINGLE_CASE_SECONDS_THRESHOLD:
-                        # Otherwise - it is new case
-                        current_time_batch += 1
-                    time_batches.append(current_time_batch)
-                    row_id += 1
+    scheduled_data = scheduled_data.groupby(cases, sort=False).agg({'stop_id': 'first',
+                                                                    'route_path_id': 'first',
+                                                                    'forecast_time': 'mean',
+                                                                    'byTelemetry': 'first',
+                                                                    'tmId': 'first',
+                                                                    'routePathId': 'first',
+                                                                    'request_time': 'mean',
+                                                                    'forecast_time_datetime': 'mean',
+                                                                    'request_time_datetime': 'mean'})
+    scheduled_data = scheduled_data.reset_index(drop=True)
 
-                scheduled_data['case'] = time_batches
-                scheduled_data = scheduled_data.groupby('case').agg({'stop_id': 'first',
-                                                                     'route_path_id': 'first',
-                                                                     'forecast_time': 'mean',
-                                                                     'byTelemetry': 'first',
-                                                                     'tmId': 'first',
-                                                                     'routePathId': 'first',
-                                                                     'request_time': 'mean',
-                                                                     'forecast_time_datetime': 'mean',
-                                                                     'request_time_datetime': 'mean'})
-                scheduled_data = scheduled_data.reset_index()
-                scheduled_data = scheduled_data.drop(columns=['case'])
+    # Telemetry is kept only for triples with at least one scheduled item
+    transponder_data = df[df['byTelemetry'] == 1]
+    transponder_data = transponder_data.drop(columns=['id'])
+    scheduled_keys = pd.MultiIndex.from_frame(scheduled_data[CASE_KEYS])
+    is_scheduled = pd.MultiIndex.from_frame(transponder_data[CASE_KEYS]).isin(scheduled_keys)
+    transponder_data = transponder_data[is_scheduled]
 
-                final_df.extend([transponder_data, scheduled_data])
-    final_df = pd.concat(final_df)
+    final_df = pd.concat([transponder_data, scheduled_data])
+    final_df = final_df.sort_values(by=CASE_KEYS, kind='mergesort')
     return final_df
@@ -0,0 +1,120 @@
+from functools import lru_cache
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+import numpy as np
+
+from mostra.io import load_pred_data
+
+import warnings
+warnings.filterwarnings('ignore')
+
+
+class PredDataQueryEngine:
+    """
+    Rus
+    Индекс для быстрого просмотра журнала прогнозов. Таблица один раз
+    сортируется по (route_path_id, stop_id, tmId, request_time,
+    forecast_time), после чего строки для маршрута, пары "маршрут -
+    остановка" или тройки "маршрут - остановка - транспорт" занимают
+    непрерывный диапазон строк. Границы диапазона находятся бинарным поиском
+    по составному целочисленному ключу, поэтому выборка не требует прохода
+    по всей таблице. Для тройки бинарным поиском находится и окно по времени
+    запроса (request_time)
+
+    :param df: raw prediction log (see load_pred_data)
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        route_codes, routes = pd.factorize(df['route_path_id'], sort=True)
+        stop_codes, stops = pd.factorize(df['stop_id'], sort=True)
+        tm_codes, tm_ids = pd.factorize(df['tmId'], sort=True)
+
+        # Identifier -> code
+        self._route_codes = {route: code for code, route in enumerate(np.asarray(routes))}
+        self._stop_codes = {stop: code for code, stop in enumerate(np.asarray(stops))}
+        self._tm_codes = {tm_id: code for code, tm_id in enumerate(np.asarray(tm_ids))}
+
+        # Composite key: rows of each route, stop and vehicle are adjacent
+        self._n_stops = len(stops)
+        self._n_tm_ids = len(tm_ids)
+        keys = (route_codes.astype(np.int64) * self._n_stops + stop_codes) * self._n_tm_ids + tm_codes
+
+        order = np.lexsort((df['forecast_time'].to_numpy(), df['request_time'].to_numpy(), keys))
+        self.df = df.take(order).reset_index(drop=True)
+        self._keys = keys[order]
+        self._request_time = self.df['request_time'].to_numpy()
+        # Offset table: rows of route with code i are in range
+        # [route_offsets[i], route_offsets[i + 1])
+        route_size = self._n_stops * self._n_tm_ids
+        self._route_offsets = np.searchsorted(self._keys, np.arange(len(routes) + 1, dtype=np.int64) * route_size)
+
+    @classmethod
+    def from_csv(cls, csv_path: Union[Path, str] = None, use_cache: bool = True):
+        """ Load pred_data.csv (see load_pred_data) and build index """
+        return cls(load_pred_data(csv_path, use_cache=use_cache))
+
+    def __len__(self):
+        return len(self.df)
+
+    def query(self, route_path_id, stop_id=None, tm_id: int = None,
+              start_time: int = None, end_time: int = None) -> pd.DataFrame:
+        """
+        Return rows for route, pair "route - stop" or triple "route - stop -
+        vehicle" with request_time in [start_time, end_time). Rows are sorted
+        by tmId, request_time and forecast_time. Unknown identifiers give
+        empty table
+        """
+        start, end = self.locate(route_path_id, stop_id, tm_id, start_time, end_time)
+        selected = self.df.iloc[start:end]
+        if tm_id is None and (start_time is not None or end_time is not None):
+            # Slice is sorted by time only inside each vehicle - filter it
+            request_time = self._request_time[start:end]
+            is_selected = np.ones(len(selected), dtype=bool)
+            if start_time is not None:
+                is_selected &= request_time >= start_time
+            if end_time is not None:
+                is_selected &= request_time < end_time
+            selected = selected[is_selected]
+        return selected
+
+    def locate(self, route_path_id, stop_id=None, tm_id: int = None,
+               start_time: int = None, end_time: int = None) -> tuple:
+        """
+        Return range of rows (start, end) for the query (see query). Time
+        window is applied only if tm_id is defined
+        """
+        if tm_id is not None and stop_id is None:
+            raise ValueError('stop_id is required to search by tm_id')
+
+        route_code = self._route_codes.get(route_path_id)
+        stop_code = self._stop_codes.get(stop_id) if stop_id is not None else 0
+        tm_code = self._tm_codes.get(tm_id) if tm_id is not None else 0
+        if route_code is None or stop_code is None or tm_code is None:
+            return 0, 0
+
+        start = int(self._route_offsets[route_code])
+        end = int(self._route_offsets[route_code + 1])
+        if stop_id is not None:
+            # Range of composite keys for the prefix inside the route rows
+            first_key = (route_code * self._n_stops + stop_code) * self._n_tm_ids + tm_code
+            last_key = first_key if tm_id is not None else first_key + self._n_tm_ids - 1
+            route_keys = self._keys[start:end]
+            start, end = (start + int(np.searchsorted(route_keys, first_key, side='left')),
+                          start + int(np.searchsorted(route_keys, last_key, side='right')))
+
+        if tm_id is not None:
+            # Rows of single vehicle are sorted by request_time
+            request_time = self._request_time[start:end]
+            if end_time is not None:
+                end = start + int(np.searchsorted(request_time, end_time, side='left'))
+            if start_time is not None:
+                start = start + int(np.searchsorted(request_time, start_time, side='left'))
+        return start, max(start, end)
+
+
+@lru_cache(maxsize=None)
+def get_query_engine(csv_path: Union[Path, str] = None) -> PredDataQueryEngine:
+    """ Return query engine for pred_data.csv. The file is loaded and indexed only once per process """
+    return PredDataQueryEngine.from_csv(csv_path)
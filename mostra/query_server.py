@@ -0,0 +1,101 @@
+import json
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from mostra.log import get_logger
+from mostra.query import PredDataQueryEngine
+
+import warnings
+warnings.filterwarnings('ignore')
+
+logger = get_logger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+# Max number of rows in single response
+DEFAULT_LIMIT = 10000
+INTEGER_PARAMETERS = ['tm_id', 'start_time', 'end_time', 'limit']
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handler for GET requests:
+        /query?route_path_id=...&stop_id=...&tm_id=...&start_time=...&end_time=...&limit=...
+        /health
+    Query parameters are the same as for PredDataQueryEngine.query
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/health':
+            self._send_json(HTTPStatus.OK, json.dumps({'rows': len(self.server.engine)}))
+            return
+        if url.path != '/query':
+            self._send_json(HTTPStatus.NOT_FOUND, json.dumps({'error': f'Unknown path {url.path}'}))
+            return
+
+        try:
+            parameters = _parse_parameters(url.query)
+            limit = parameters.pop('limit', DEFAULT_LIMIT)
+            selected = self.server.engine.query(**parameters)
+        except (TypeError, ValueError) as ex:
+            self._send_json(HTTPStatus.BAD_REQUEST, json.dumps({'error': str(ex)}))
+            return
+
+        # Table is serialized by pandas and inserted into response as is
+        items = selected.iloc[:limit].to_json(orient='records')
+        self._send_json(HTTPStatus.OK, f'{{"rows": {len(selected)}, "items": {items}}}')
+
+    def _send_json(self, status: HTTPStatus, body: str):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+
+def _parse_parameters(query: str) -> dict:
+    parameters = {key: values[-1] for key, values in parse_qs(query).items()}
+    if 'route_path_id' not in parameters:
+        raise ValueError('route_path_id is required')
+    for key in INTEGER_PARAMETERS:
+        if key in parameters:
+            parameters[key] = int(parameters[key])
+    return parameters
+
+
+def create_query_server(engine: PredDataQueryEngine, host: str = DEFAULT_HOST,
+                        port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """ Create HTTP server for the engine (port 0 means any free port) """
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    server.engine = engine
+    return server
+
+
+def serve_queries(engine: PredDataQueryEngine, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    """
+    Rus
+    Запускает локальный HTTP сервер, который отвечает на запросы к журналу
+    прогнозов в формате JSON. Таблица загружается и индексируется один раз,
+    поэтому каждый запрос не требует повторного чтения pred_data.csv.
+
+    Example:
+        curl "http://127.0.0.1:8765/query?route_path_id=...&stop_id=...&tm_id=55830"
+
+    :param engine: query engine with loaded prediction log
+    :param host: host to listen
+    :param port: port to listen
+    """
+    server = create_query_server(engine, host, port)
+    logger.info(f'Serve {len(engine)} rows on http://{host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,160 @@
+from typing import Optional, Sequence, Tuple
+
+import pandas as pd
+import numpy as np
+
+from mostra.catalog import StopCatalog
+from mostra.convert import prepare_points_layer
+
+import warnings
+warnings.filterwarnings('ignore')
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    # scipy is optional - brute force search is used without it
+    cKDTree = None
+
+# Projected CRS with meters for Moscow (UTM zone 37N). Web Mercator (3857)
+# stretches distances about 1.8 times at Moscow latitude
+METRIC_EPSG_CODE = 32637
+# Paired bus and tram platforms are usually closer than that
+DEFAULT_RADIUS_METERS = 50
+# Number of query points per block in brute force search
+BRUTE_FORCE_BLOCK_SIZE = 1024
+
+
+class StopSpatialIndex:
+    """
+    Rus
+    Пространственный индекс остановок для поиска всех остановок в радиусе R
+    метров и k ближайших остановок. Координаты переводятся в метрическую
+    проекцию (см. prepare_points_layer), поиск выполняется KD-деревом
+    (scipy). Если scipy не установлен, то используется поиск перебором
+    блоками по BRUTE_FORCE_BLOCK_SIZE точек. Все запросы выполняются сразу
+    для множества точек
+
+    :param stops: table with stop_id, lat and lon columns (one row per stop)
+    :param epsg_code: code of projected CRS with meters
+    """
+
+    def __init__(self, stops: pd.DataFrame, epsg_code: int = METRIC_EPSG_CODE):
+        self.epsg_code = epsg_code
+        self.stop_ids = stops['stop_id'].to_numpy()
+        self.coordinates = self.project(stops['lat'], stops['lon'])
+        self._positions = pd.Index(self.stop_ids)
+        self._tree = cKDTree(self.coordinates) if cKDTree is not None else None
+
+    @classmethod
+    def from_catalog(cls, catalog: StopCatalog, epsg_code: int = METRIC_EPSG_CODE):
+        return cls(catalog.stops[['lat', 'lon']].reset_index(), epsg_code)
+
+    def __len__(self):
+        return len(self.stop_ids)
+
+    def project(self, lat: Sequence[float], lon: Sequence[float]) -> np.ndarray:
+        """ Return array (n, 2) with coordinates of points in the index CRS """
+        points = prepare_points_layer(pd.DataFrame({'lat': np.asarray(lat), 'lon': np.asarray(lon)}))
+        points = points.to_crs(self.epsg_code)
+        return np.column_stack([points.geometry.x.to_numpy(), points.geometry.y.to_numpy()])
+
+    def stop_coordinates(self, stop_ids: Sequence) -> np.ndarray:
+        """ Return projected coordinates of stops. Raise KeyError for unknown stops """
+        positions = self._positions.get_indexer(stop_ids)
+        if (positions < 0).any():
+            raise KeyError('Unknown stop_id')
+        return self.coordinates[positions]
+
+    def query_radius(self, points: np.ndarray, radius: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Find all stops within radius (in meters) for each point. Return arrays
+        (point positions, stop positions, distances) for all found pairs
+        """
+        if self._tree is not None:
+            pairs = cKDTree(points).sparse_distance_matrix(self._tree, radius, output_type='ndarray')
+            return pairs['i'], pairs['j'], pairs['v']
+
+        point_ids, stop_ids, distances = [], [], []
+        for start, block_distances in self._iterate_distance_blocks(points):
+            block_point_ids, block_stop_ids = np.nonzero(block_distances <= radius)
+            point_ids.append(block_point_ids + start)
+            stop_ids.append(block_stop_ids)
+            distances.append(block_distances[block_point_ids, block_stop_ids])
+        if len(point_ids) < 1:
+            return np.array([], dtype=int), np.array([], dtype=int), np.array([])
+        return np.concatenate(point_ids), np.concatenate(stop_ids), np.concatenate(distances)
+
+    def query_nearest(self, points: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find k nearest stops for each point. Return arrays (n, k) with
+        distances (in meters) and stop positions sorted by distance
+        """
+        k = min(k, len(self))
+        if self._tree is not None:
+            distances, stop_ids = self._tree.query(points, k=k)
+            return distances.reshape(len(points), k), stop_ids.reshape(len(points), k)
+
+        distances = np.empty((len(points), k))
+        stop_ids = np.empty((len(points), k), dtype=int)
+        for start, block_distances in self._iterate_distance_blocks(points):
+            nearest = np.argpartition(block_distances, k - 1, axis=1)[:, :k]
+            nearest_distances = np.take_along_axis(block_distances, nearest, axis=1)
+            order = np.argsort(nearest_distances, axis=1, kind='stable')
+            end = start + len(block_distances)
+            distances[start:end] = np.take_along_axis(nearest_distances, order, axis=1)
+            stop_ids[start:end] = np.take_along_axis(nearest, order, axis=1)
+        return distances, stop_ids
+
+    def stops_within(self, radius: float = DEFAULT_RADIUS_METERS,
+                     stop_ids: Optional[Sequence] = None) -> pd.DataFrame:
+        """
+        Rus
+        Для каждой остановки находит все остановки в радиусе radius метров
+        (включая саму остановку с расстоянием 0)
+
+        :param radius: search radius in meters
+        :param stop_ids: stops to search neighbours for. If None - all stops
+        from the index
+
+        :return: table with stop_id, neighbour_stop_id and distance columns
+        """
+        if stop_ids is None:
+            stop_ids = self.stop_ids
+        stop_ids = np.asarray(stop_ids)
+        point_ids, neighbour_ids, distances = self.query_radius(self.stop_coordinates(stop_ids), radius)
+        return pd.DataFrame({'stop_id': stop_ids[point_ids],
+                             'neighbour_stop_id': self.stop_ids[neighbour_ids],
+                             'distance': distances})
+
+    def nearest_stops(self, k: int = 1, stop_ids: Optional[Sequence] = None) -> pd.DataFrame:
+        """
+        Rus
+        Для каждой остановки находит k ближайших других остановок
+
+        :param k: number of neighbours
+        :param stop_ids: stops to search neighbours for. If None - all stops
+        from the index
+
+        :return: table with stop_id, neighbour_stop_id, distance and rank
+        (from 1 for the nearest) columns
+        """
+        if stop_ids is None:
+            stop_ids = self.stop_ids
+        stop_ids = np.asarray(stop_ids)
+        # The stop itself is always found at zero distance - take one more
+        distances, neighbour_ids = self.query_nearest(self.stop_coordinates(stop_ids), k + 1)
+
+        query_ids = np.repeat(np.arange(len(stop_ids)), distances.shape[1])
+        neighbours = pd.DataFrame({'stop_id': stop_ids[query_ids],
+                                   'neighbour_stop_id': self.stop_ids[neighbour_ids.ravel()],
+                                   'distance': distances.ravel()})
+        neighbours = neighbours[neighbours['neighbour_stop_id'] != neighbours['stop_id']]
+        neighbours['rank'] = neighbours.groupby('stop_id', sort=False).cumcount() + 1
+        return neighbours[neighbours['rank'] <= k].reset_index(drop=True)
+
+    def _iterate_distance_blocks(self, points: np.ndarray):
+        """ Distances from blocks of points to all stops (for search without scipy) """
+        for start in range(0, len(points), BRUTE_FORCE_BLOCK_SIZE):
+            block = points[start: start + BRUTE_FORCE_BLOCK_SIZE]
+            differences = block[:, None, :] - self.coordinates[None, :, :]
+            yield start, np.sqrt((differences ** 2).sum(axis=2))
@@ -0,0 +1,69 @@
+import pandas as pd
+
+from mostra.data_structure import HOUR_INTO_DAYTIME
+from mostra.instrumentation import instrumented
+
+import warnings
+warnings.filterwarnings('ignore')
+
+# Minimal delay (in minutes) to consider arrival as late
+TH_MINUTES = 1
+DELAY_COLUMN = 'Отклонение от расписания, мин'
+DAYTIME_COLUMN = 'Время суток'
+DAYTIME_ORDER = ['утр. час пик', 'утро', 'день', 'веч. час пик', 'вечер', 'ночь']
+
+
+def calculate_delay_minutes(actual: pd.DataFrame) -> pd.Series:
+    """ Difference between actual arrival time and forecasted (scheduled) time in minutes """
+    return (actual['arrival_time'] - actual['forecast_time']) / 60
+
+
+def calculate_daytime(actual: pd.DataFrame) -> pd.Series:
+    """ Period of the day (see HOUR_INTO_DAYTIME) of actual arrival """
+    return pd.to_datetime(actual['arrival_time'], unit='s').dt.hour.replace(HOUR_INTO_DAYTIME)
+
+
+@instrumented('report')
+def route_punctuality_report(actual: pd.DataFrame, th_minutes: float = TH_MINUTES,
+                             by_daytime: bool = False) -> pd.DataFrame:
+    """
+    Rus
+    Отчет о пунктуальности транспорта по маршрутам: доля опозданий (в
+    процентах, опозданием считается отклонение от расписания не менее
+    th_minutes минут), доля прибытий по расписанию и среднее время опозданий.
+    Маршруты, для которых все прибытия были только с опозданием или только
+    без опоздания, в отчет не попадают. Все маршруты считаются за один
+    проход по таблице
+
+    :param actual: table with actual arrival time (actual_vs_forecasted.csv)
+    :param th_minutes: minimal delay in minutes to consider arrival as late
+    :param by_daytime: if True - statistics are calculated separately for each
+    period of the day (see HOUR_INTO_DAYTIME)
+    """
+    delay = calculate_delay_minutes(actual)
+    is_true_late = (delay > 0) & (delay >= th_minutes)
+    statistics = pd.DataFrame({'route_path_id': actual['route_path_id'],
+                               'transport_type': actual['transport_type'],
+                               'number': actual['number'],
+                               'is_late': delay > 0,
+                               'is_true_late': is_true_late,
+                               'true_late_delay': delay.where(is_true_late)})
+    keys = ['route_path_id']
+    if by_daytime:
+        statistics[DAYTIME_COLUMN] = calculate_daytime(actual)
+        keys.append(DAYTIME_COLUMN)
+
+    report = statistics.groupby(keys, sort=False).agg(transport_type=('transport_type', 'first'),
+                                                      number=('number', 'first'),
+                                                      arrivals=('is_late', 'size'),
+                                                      late=('is_late', 'sum'),
+                                                      true_late=('is_true_late', 'sum'),
+                                                      mean_delay=('true_late_delay', 'mean'))
+    report = report[(report['late'] > 0) & (report['late'] < report['arrivals'])]
+    report = report.reset_index()
+
+    report['Доля опозданий'] = (report['true_late'] / report['arrivals'] * 100).round(0)
+    report['Доля прибытий по расписанию'] = 100 - report['Доля опозданий']
+    report['Среднее время опозданий, мин'] = report['mean_delay'].fillna(0)
+    return report[keys + ['transport_type', 'number', 'Доля опозданий',
+                          'Доля прибытий по расписанию', 'Среднее время опозданий, мин']]
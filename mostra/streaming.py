@@ -0,0 +1,161 @@
+from pathlib import Path
+from typing import List, Optional, Union
+
+import pandas as pd
+
+from mostra.arrival import calculate_arrival_time
+from mostra.catalog import StopCatalog, get_stop_catalog
+from mostra.data_structure import COLUMN_NAMES
+from mostra.io import read_pred_data_csv
+from mostra.log import get_logger, progress
+from mostra.parallel import imap_in_parallel
+from mostra.paths import create_folder, get_data_path
+from mostra.preprocessing import aggregate_schedule_items
+
+import warnings
+warnings.filterwarnings('ignore')
+
+logger = get_logger(__name__)
+
+DEFAULT_MEMORY_BUDGET_MB = 512
+# Number of rows to estimate memory consumption of single row
+SAMPLE_ROWS = 10000
+# Only files with that suffix are created and removed in the shards folder
+SHARD_SUFFIX = '.shard.csv'
+
+
+def estimate_chunk_size(csv_path: Union[Path, str], memory_budget_mb: float) -> int:
+    """
+    Define how many rows of pred_data.csv can be loaded at once to fit
+    into the memory budget
+
+    :param csv_path: path to the csv file
+    :param memory_budget_mb: memory budget for single chunk in megabytes
+    """
+    sample = pd.read_csv(csv_path, names=COLUMN_NAMES, nrows=SAMPLE_ROWS)
+    if len(sample) < 1:
+        return SAMPLE_ROWS
+
+    row_size = sample.memory_usage(deep=True).sum() / len(sample)
+    return max(int(memory_budget_mb * 1024 * 1024 / row_size), 1)
+
+
+def split_into_route_shards(csv_path: Union[Path, str],
+                            shards_folder: Union[Path, str],
+                            memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB) -> List[Path]:
+    """
+    Rus
+    Читает pred_data.csv по частям (размер части определяется бюджетом
+    памяти) и раскладывает строки по файлам - отдельный файл для каждого
+    route_path_id. Файлы имеют тот же формат, что и исходный датасет и
+    расширение SHARD_SUFFIX - другие файлы в папке не изменяются
+
+    :param csv_path: path to the pred_data.csv file
+    :param shards_folder: folder to save shards into
+    :param memory_budget_mb: memory budget for single chunk in megabytes
+    """
+    shards_folder = create_folder(shards_folder)
+    # Remove shards from previous launch - new rows are appended to files
+    for old_shard in shards_folder.glob(f'*{SHARD_SUFFIX}'):
+        old_shard.unlink()
+
+    chunk_size = estimate_chunk_size(csv_path, memory_budget_mb)
+    for chunk in pd.read_csv(csv_path, names=COLUMN_NAMES, chunksize=chunk_size):
+        for route_path_id, route_chunk in chunk.groupby('route_path_id'):
+            route_chunk.to_csv(Path(shards_folder, f'{route_path_id}{SHARD_SUFFIX}'),
+                               mode='a', header=False, index=False)
+
+    shard_paths = list(shards_folder.glob(f'*{SHARD_SUFFIX}'))
+    shard_paths.sort()
+    return shard_paths
+
+
+def process_shard(shard_path: Path, catalog: StopCatalog):
+    """ Aggregate scheduled items and assign arrival time for single shard """
+    logger.debug(f'Process shard {shard_path.name[:-len(SHARD_SUFFIX)]}')
+    route_df = read_pred_data_csv(shard_path)
+
+    preprocessed_df = aggregate_schedule_items(route_df)
+    arrival_df = calculate_arrival_time(preprocessed_df, catalog, show_progress=False)
+    return preprocessed_df, arrival_df
+
+
+def process_route_shards(shard_paths: List[Path],
+                         preprocessed_path: Union[Path, str],
+                         arrival_path: Union[Path, str],
+                         n_jobs: int = 1,
+                         catalog: Optional[StopCatalog] = None):
+    """
+    Rus
+    Для каждого маршрута выполняет агрегацию данных расписания и расчет
+    фактического времени прибытия. Результаты дописываются в итоговые
+    таблицы в порядке следования файлов, поэтому в памяти одновременно
+    находятся данные только нескольких маршрутов (по числу процессов).
+    Таблицы от предыдущего запуска удаляются перед началом обработки
+
+    :param shard_paths: paths to the files with routes data
+    :param preprocessed_path: path to save aggregated table into
+    :param arrival_path: path to save table with actual arrival time into
+    :param n_jobs: number of processes to process shards in parallel.
+    -1 means all available cores
+    :param catalog: catalog of stops and routes. If None - catalog is loaded
+    from stop_from_repo.csv in data folder
+    """
+    if catalog is None:
+        catalog = get_stop_catalog()
+
+    # Tables from previous launch must not remain if there are no results
+    for output_path in [preprocessed_path, arrival_path]:
+        Path(output_path).unlink(missing_ok=True)
+
+    is_preprocessed_empty = True
+    is_arrival_empty = True
+    results = imap_in_parallel(process_shard, shard_paths, n_jobs, catalog=catalog)
+    for preprocessed_df, arrival_df in progress(results, 'Process route shards', total=len(shard_paths)):
+        preprocessed_df.to_csv(preprocessed_path, index=False, mode='a',
+                               header=is_preprocessed_empty)
+        is_preprocessed_empty = False
+
+        if len(arrival_df) < 1:
+            continue
+        arrival_df.to_csv(arrival_path, index=False, mode='a',
+                          header=is_arrival_empty)
+        is_arrival_empty = False
+
+
+def process_pred_data_by_routes(csv_path: Union[Path, str] = None,
+                                memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                                shards_folder: Union[Path, str] = None,
+                                n_jobs: int = 1,
+                                catalog: Optional[StopCatalog] = None):
+    """
+    Rus
+    Потоковый режим обработки pred_data.csv, который не помещается в
+    оперативную память. Результат такой же как при последовательном запуске
+    aggregate_schedule_items и calculate_arrival_time для всей таблицы:
+    в папке с данными создаются pred_data_preprocessed.csv и
+    actual_vs_forecasted.csv. Пиковое потребление памяти определяется самым
+    большим маршрутом и размером части исходного файла
+
+    :param csv_path: path to the csv file. If None - pred_data.csv from data
+    folder is used. Output tables are saved into the same folder
+    :param memory_budget_mb: memory budget for reading single chunk of
+    csv file in megabytes
+    :param shards_folder: folder for intermediate files per route. If None -
+    folder "shards" next to the csv file is used
+    :param n_jobs: number of processes to process routes in parallel.
+    -1 means all available cores
+    :param catalog: catalog of stops and routes. If None - catalog is loaded
+    from stop_from_repo.csv in data folder
+    """
+    if csv_path is None:
+        csv_path = Path(get_data_path(), 'pred_data.csv')
+    data_folder = Path(csv_path).parent
+    if shards_folder is None:
+        shards_folder = Path(data_folder, 'shards')
+
+    shard_paths = split_into_route_shards(csv_path, shards_folder, memory_budget_mb)
+    process_route_shards(shard_paths,
+                         preprocessed_path=Path(data_folder, 'pred_data_preprocessed.csv'),
+                         arrival_path=Path(data_folder, 'actual_vs_forecasted.csv'),
+                         n_jobs=n_jobs, catalog=catalog)
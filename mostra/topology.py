@@ -0,0 +1,183 @@
+from pathlib import Path
+from typing import Union
+
+import pandas as pd
+import numpy as np
+
+from mostra.ids import decode_id_columns, encode_id_columns
+from mostra.instrumentation import instrumented
+from mostra.log import get_logger
+
+import warnings
+warnings.filterwarnings('ignore')
+
+logger = get_logger(__name__)
+
+TOPOLOGY_COLUMNS = ['route_path_id', 'position', 'stop_id', 'confidence', 'n_vehicles']
+
+
+class RouteTopology:
+    """
+    Rus
+    Порядок остановок на маршрутах, восстановленный по данным расписания
+    (см. infer_route_topology). Для каждого маршрута хранится упорядоченный
+    список остановок и оценка надежности порядка (confidence) - доля пар
+    остановок у всех транспортных средств, порядок посещения которых
+    совпадает с итоговым порядком
+
+    :param table: table with route_path_id, position, stop_id, confidence
+    and n_vehicles columns
+    """
+
+    def __init__(self, table: pd.DataFrame):
+        self.table = table.sort_values(by=['route_path_id', 'position'])
+        self._stops_order = {}
+        self._confidence = {}
+        for route_path_id, route_table in self.table.groupby('route_path_id', sort=False):
+            self._stops_order[route_path_id] = list(route_table['stop_id'])
+            self._confidence[route_path_id] = route_table['confidence'].iloc[0]
+
+    @classmethod
+    def from_csv(cls, csv_path: Union[Path, str], encode_ids: bool = False):
+        """
+        Load topology from csv file with UUID identifiers. If encode_ids is
+        True - stop_id and route_path_id are replaced with int32 codes (see
+        mostra.ids)
+        """
+        table = pd.read_csv(csv_path, dtype={'route_path_id': str, 'stop_id': str})
+        if encode_ids:
+            table = encode_id_columns(table)
+        return cls(table)
+
+    def to_csv(self, csv_path: Union[Path, str], decode_ids: bool = False):
+        """ Save topology. If decode_ids is True - int32 codes are replaced with UUID identifiers """
+        table = decode_id_columns(self.table) if decode_ids else self.table
+        table.to_csv(csv_path, index=False)
+
+    def routes(self) -> list:
+        return list(self._stops_order.keys())
+
+    def stops_order(self, route_path_id) -> list:
+        """ Return ordered list of stop_id for the route (empty list for unknown route) """
+        return self._stops_order.get(route_path_id, [])
+
+    def confidence(self, route_path_id) -> float:
+        """ Return confidence of the stops order (NaN for unknown route) """
+        return self._confidence.get(route_path_id, np.nan)
+
+    def for_route(self, route_path_id) -> 'RouteTopology':
+        """ Return topology with single route (to send to worker process) """
+        return RouteTopology(self.table[self.table['route_path_id'] == route_path_id])
+
+    def update(self, topology: 'RouteTopology') -> 'RouteTopology':
+        """ Return topology with routes from both objects (routes from the argument have priority) """
+        table = self.table[~self.table['route_path_id'].isin(topology.routes())]
+        return RouteTopology(pd.concat([table, topology.table], ignore_index=True))
+
+
+@instrumented('topology')
+def infer_route_topology(df: pd.DataFrame) -> RouteTopology:
+    """
+    Rus
+    Восстанавливает порядок остановок для каждого маршрута по данным
+    расписания всех транспортных средств. Для каждого транспорта остановки
+    ранжируются по времени первого прибытия, после чего порядок определяется
+    большинством: остановка A идет раньше остановки B, если большинство
+    транспортных средств, побывавших на обеих остановках, прибывает на A
+    раньше. Итоговый порядок - сортировка по числу таких "побед" (метод
+    Копленда), при равенстве - по среднему относительному рангу
+
+    :param df: table with route_path_id, stop_id, tmId, byTelemetry and
+    forecast_time columns (raw or preprocessed)
+    """
+    scheduled = df[(df['byTelemetry'] == 0) & (df['tmId'] != 0) & df['tmId'].notna()]
+    first_visits = scheduled.groupby(['route_path_id', 'tmId', 'stop_id'], sort=False,
+                                     observed=True)['forecast_time'].min().reset_index()
+    # Rank of the stop in the order of the first visits of the vehicle
+    vehicle_groups = first_visits.groupby(['route_path_id', 'tmId'], sort=False, observed=True)
+    first_visits['rank'] = vehicle_groups['forecast_time'].rank(method='first')
+    first_visits['relative_rank'] = first_visits['rank'] / vehicle_groups['rank'].transform('max')
+
+    tables = [_majority_order(route_path_id, route_visits) for route_path_id, route_visits
+              in first_visits.groupby('route_path_id', sort=False, observed=True)]
+    if len(tables) < 1:
+        return RouteTopology(pd.DataFrame(columns=TOPOLOGY_COLUMNS))
+    return RouteTopology(pd.concat(tables, ignore_index=True))
+
+
+def _majority_order(route_path_id, route_visits: pd.DataFrame) -> pd.DataFrame:
+    """ Order stops of single route by pairwise majority of vehicles """
+    stop_codes, stop_ids = pd.factorize(route_visits['stop_id'])
+    vehicle_codes, vehicles = pd.factorize(route_visits['tmId'])
+
+    # Matrix "vehicle - stop" with ranks (NaN if vehicle was not at the stop)
+    ranks = np.full((len(vehicles), len(stop_ids)), np.nan)
+    ranks[vehicle_codes, stop_codes] = route_visits['rank'].to_numpy()
+    relative_ranks = np.full((len(vehicles), len(stop_ids)), np.nan)
+    relative_ranks[vehicle_codes, stop_codes] = route_visits['relative_rank'].to_numpy()
+
+    # wins[i, j] - number of vehicles which arrive at stop i before stop j
+    # (comparisons with NaN are False, so only vehicles visited both stops count)
+    wins = (ranks[:, :, None] < ranks[:, None, :]).sum(axis=0)
+    copeland_score = (wins > wins.T).sum(axis=1) - (wins < wins.T).sum(axis=1)
+    order = np.lexsort((np.nanmean(relative_ranks, axis=0), -copeland_score))
+
+    ordered_wins = wins[np.ix_(order, order)]
+    agreed = np.triu(ordered_wins, k=1).sum()
+    total = agreed + np.tril(ordered_wins, k=-1).sum()
+    confidence = agreed / total if total > 0 else 1.0
+
+    return pd.DataFrame({'route_path_id': route_path_id,
+                         'position': np.arange(len(order)),
+                         'stop_id': np.asarray(stop_ids)[order],
+                         'confidence': round(confidence, 4),
+                         'n_vehicles': len(vehicles)})
+
+
+def get_route_topology(df: pd.DataFrame, topology_path: Union[Path, str] = None,
+                       data_path: Union[Path, str] = None) -> RouteTopology:
+    """
+    Rus
+    Возвращает порядок остановок для всех маршрутов из таблицы. Если файл
+    topology_path существует (и создан позже файла с данными data_path), то
+    порядок берется из него, а вычисляется только для отсутствующих в файле
+    маршрутов. Обновленный результат сохраняется в topology_path. В файле
+    всегда хранятся UUID идентификаторы, поэтому один файл используется как
+    для исходных данных, так и для данных с целочисленными кодами (см.
+    mostra.ids)
+
+    :param df: table with transport data
+    :param topology_path: path to csv file with cached topology. If None -
+    topology is not saved
+    :param data_path: path to the file with transport data. If defined -
+    cache older than the file is not used
+    """
+    # Identifiers in the table can be replaced with int32 codes
+    route_path_ids = df['route_path_id']
+    if isinstance(route_path_ids.dtype, pd.CategoricalDtype):
+        route_path_ids = route_path_ids.cat.categories
+    is_encoded = pd.api.types.is_integer_dtype(route_path_ids)
+    topology = None
+    if topology_path is not None and _is_cache_up_to_date(Path(topology_path), data_path):
+        topology = RouteTopology.from_csv(topology_path, encode_ids=is_encoded)
+
+    missing_routes = np.asarray(df['route_path_id'].unique())
+    if topology is not None:
+        missing_routes = np.setdiff1d(missing_routes, topology.routes())
+    if len(missing_routes) < 1:
+        return topology
+
+    logger.debug(f'Infer stops order for {len(missing_routes)} routes')
+    inferred = infer_route_topology(df[df['route_path_id'].isin(missing_routes)])
+    topology = inferred if topology is None else topology.update(inferred)
+    if topology_path is not None:
+        topology.to_csv(topology_path, decode_ids=is_encoded)
+    return topology
+
+
+def _is_cache_up_to_date(topology_path: Path, data_path: Union[Path, str] = None) -> bool:
+    if not topology_path.is_file():
+        return False
+    if data_path is None:
+        return True
+    return topology_path.stat().st_mtime > Path(data_path).stat().st_mtime
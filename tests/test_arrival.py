@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+from mostra.arrival import CASE_SECONDS_TEL_THRESHOLD, assign_actual_arrival_time, assign_telemetry_cases, \
+    enrich_with_cases_and_horizon
+from mostra.data_structure import COLUMN_NAMES
+
+BASE_TIME = 1658631600
+
+
+def _triple_df(scheduled_times: list, tel_times: list) -> pd.DataFrame:
+    forecast_times = scheduled_times + tel_times
+    return pd.DataFrame({'stop_id': 's', 'route_path_id': 'r', 'tmId': 1,
+                         'forecast_time': [BASE_TIME + time for time in forecast_times],
+                         'byTelemetry': [0] * len(scheduled_times) + [1] * len(tel_times),
+                         'request_time': BASE_TIME - 60})
+
+
+def test_telemetry_is_assigned_to_nearer_right_case():
+    # Scheduled items form two cases (0 and 1000 seconds). Telemetry at 700
+    # is 700 seconds after the left case and 300 seconds before the right one
+    df = enrich_with_cases_and_horizon(_triple_df([0, 1000], [700]))
+    telemetry = df[df['byTelemetry'] == 1]
+    assert list(telemetry['case']) == [1]
+
+
+def test_telemetry_is_assigned_to_nearer_left_case():
+    df = enrich_with_cases_and_horizon(_triple_df([0, 1000], [300]))
+    telemetry = df[df['byTelemetry'] == 1]
+    assert list(telemetry['case']) == [0]
+
+
+def test_assign_telemetry_cases_neighbours():
+    scheduled_groups = np.array([0, 0, 1])
+    scheduled_times = np.array([0., 1000., 0.])
+    scheduled_cases = np.array([0, 1, 0])
+    tel_groups = np.array([0, 0, 0, 1, 1])
+    # Right is nearer, tie (left is taken), after the last item, far from
+    # the only item of the group, before the first item of the group
+    tel_times = np.array([700., 500., 1100., CASE_SECONDS_TEL_THRESHOLD + 10., -100.])
+    tel_cases = assign_telemetry_cases(scheduled_groups, scheduled_times, scheduled_cases,
+                                       tel_groups, tel_times, CASE_SECONDS_TEL_THRESHOLD)
+    np.testing.assert_array_equal(tel_cases, [1, 0, 1, np.nan, 0])
+
+
+def test_arrival_time_from_first_of_equal_minimal_horizons():
+    # Two telemetry rows have the same minimal horizon (60 seconds) - the
+    # first one (by forecast time) defines arrival time. Rows with minimal
+    # horizon are excluded from the result
+    df = pd.DataFrame({'id': range(5), 'stop_id': 's', 'route_path_id': 'r', 'tmId': 1, 'routePathId': 'r',
+                       'forecast_time': [BASE_TIME + time for time in [1000, 1020, 1010, 1005, 1040]],
+                       'byTelemetry': [0, 1, 1, 1, 1],
+                       'request_time': [BASE_TIME + time for time in [100, 960, 950, 705, 900]]})
+    df = df[COLUMN_NAMES]
+    stop_coordinates = pd.DataFrame({'stop_id': ['s'], 'lat': [55.75], 'lon': [37.62]})
+    arrival = assign_actual_arrival_time(df, stop_coordinates)
+
+    assert list(arrival.columns) == ['stop_id', 'route_path_id', 'forecast_time', 'byTelemetry', 'tmId',
+                                     'routePathId', 'request_time', 'lat', 'lon', 'case', 'arrival_time']
+    assert list(arrival['forecast_time']) == [BASE_TIME + 1000, BASE_TIME + 1005, BASE_TIME + 1040]
+    assert (arrival['arrival_time'] == BASE_TIME + 1010).all()
+    assert (arrival['case'] == 0).all()
+    assert (arrival[['lat', 'lon']].to_numpy() == [55.75, 37.62]).all()
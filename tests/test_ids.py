@@ -0,0 +1,45 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from mostra.ids import MISSING_CODE, IdDictionary
+
+
+def _encode_in_process(path: str, values: list) -> list:
+    return IdDictionary(path).encode(values).tolist()
+
+
+def test_missing_values_are_kept(tmp_path):
+    ids = IdDictionary(tmp_path / 'ids.txt')
+    for values in [pd.Series(['a', 'b', np.nan, 'c'], dtype='category'),
+                   pd.Series(['a', None, 'b', np.nan, 'c'])]:
+        codes = ids.encode(values)
+        assert (codes[values.isna().to_numpy()] == MISSING_CODE).all()
+        decoded = pd.Series(ids.decode(codes))
+        pd.testing.assert_series_equal(decoded, values.astype(object).where(values.notna(), np.nan),
+                                       check_dtype=False)
+    assert (tmp_path / 'ids.txt').read_text().splitlines() == ['a', 'b', 'c']
+
+
+def test_appends_of_other_instances_are_visible(tmp_path):
+    path = tmp_path / 'ids.txt'
+    first, second = IdDictionary(path), IdDictionary(path)
+    first.encode(['a', 'b'])
+    # The second instance has stale state but must not give the same codes
+    # to other identifiers
+    assert second.encode(['c', 'b']).tolist() == [2, 1]
+    assert first.decode([2]).tolist() == ['c']
+    assert path.read_text().splitlines() == ['a', 'b', 'c']
+
+
+def test_concurrent_appends(tmp_path):
+    path = str(tmp_path / 'ids.txt')
+    batches = [[f'id_{(i * 7 + j) % 50}' for j in range(30)] for i in range(8)]
+    with ProcessPoolExecutor(4) as executor:
+        results = list(executor.map(_encode_in_process, [path] * len(batches), batches))
+
+    ids = IdDictionary(path)
+    assert len(ids) == 50
+    for values, codes in zip(batches, results):
+        assert ids.decode(codes).tolist() == values
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_pred_data, generate_stop_from_repo
+from mostra.arrival import calculate_arrival_time
+from mostra.catalog import StopCatalog
+from mostra.incremental import IncrementalPipeline
+from mostra.io import read_pred_data_csv
+from mostra.preprocessing import aggregate_schedule_items
+
+N_APPENDS = 5
+
+
+@pytest.fixture(scope='module')
+def synthetic_data():
+    rng = np.random.default_rng(0)
+    stop_from_repo = generate_stop_from_repo(5, rng)
+    pred_data = generate_pred_data(stop_from_repo, 20000, rng)
+    return stop_from_repo, pred_data.to_csv(index=False, header=False).encode()
+
+
+def _sort_rows(df: pd.DataFrame) -> pd.DataFrame:
+    # Means of datetime columns can differ in nanoseconds due to float rounding
+    for column in [column for column in df.columns if column.endswith('_datetime')]:
+        df[column] = pd.to_datetime(df[column]).dt.round('ms')
+    columns = sorted(df.columns)
+    return df[columns].sort_values(by=columns, kind='mergesort').reset_index(drop=True)
+
+
+def _assert_same_as_full_recompute(pipeline: IncrementalPipeline, catalog: StopCatalog, tmp_path):
+    preprocessed = aggregate_schedule_items(read_pred_data_csv(pipeline.csv_path))
+    arrival = calculate_arrival_time(preprocessed, catalog, show_progress=False)
+
+    for expected, actual_path in [(preprocessed, pipeline.preprocessed_path), (arrival, pipeline.arrival_path)]:
+        # Compare tables after the same csv round trip
+        expected_path = tmp_path / f'expected_{actual_path.name}'
+        expected.to_csv(expected_path, index=False)
+        pd.testing.assert_frame_equal(_sort_rows(pd.read_csv(actual_path)),
+                                      _sort_rows(pd.read_csv(expected_path)))
+
+
+def test_appends_give_full_recompute_result(synthetic_data, tmp_path):
+    stop_from_repo, content = synthetic_data
+    catalog = StopCatalog(stop_from_repo)
+    csv_path = tmp_path / 'data' / 'pred_data.csv'
+    csv_path.parent.mkdir()
+    pipeline = IncrementalPipeline(csv_path, catalog=catalog)
+
+    # Each append ends in the middle of the line - it is finished by the next append
+    bounds = np.linspace(0, len(content), N_APPENDS + 1).astype(int)
+    processed = 0
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        with open(csv_path, 'ab') as f:
+            f.write(content[start:end])
+        processed += pipeline.refresh()
+        if end < len(content):
+            assert not content[:end].endswith(b'\n')
+            assert processed == content[:end].count(b'\n')
+
+    assert processed == content.count(b'\n')
+    _assert_same_as_full_recompute(pipeline, catalog, tmp_path)
+    # Nothing new - nothing changes
+    assert pipeline.refresh() == 0
+    _assert_same_as_full_recompute(pipeline, catalog, tmp_path)
+
+
+def test_rewritten_file_is_processed_from_scratch(synthetic_data, tmp_path):
+    stop_from_repo, content = synthetic_data
+    catalog = StopCatalog(stop_from_repo)
+    csv_path = tmp_path / 'data' / 'pred_data.csv'
+    csv_path.parent.mkdir()
+
+    lines = content.splitlines(keepends=True)
+    csv_path.write_bytes(b''.join(lines[:len(lines) // 2]))
+    IncrementalPipeline(csv_path, catalog=catalog).refresh()
+
+    # The file is rewritten with other rows and becomes larger
+    rewritten = b''.join(lines[len(lines) // 4:])
+    assert len(rewritten) > len(b''.join(lines[:len(lines) // 2]))
+    csv_path.write_bytes(rewritten)
+    pipeline = IncrementalPipeline(csv_path, catalog=catalog)
+    assert pipeline.refresh() == len(lines) - len(lines) // 4
+    _assert_same_as_full_recompute(pipeline, catalog, tmp_path)
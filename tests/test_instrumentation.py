@@ -0,0 +1,31 @@
+import json
+import time
+
+import numpy as np
+
+from mostra.instrumentation import configure_instrumentation, track_stage
+
+
+def _hold_memory(megabytes: int, seconds: float):
+    data = np.ones(megabytes * 1024 * 1024 // 8)
+    time.sleep(seconds)
+    return data.sum()
+
+
+def test_stage_memory_is_measured_per_stage(tmp_path):
+    stages_log = tmp_path / 'stages.jsonl'
+    configure_instrumentation(stages_log=stages_log)
+    try:
+        with track_stage('large'):
+            _hold_memory(400, 0.2)
+        # The second stage peaks below the first one - process peak does
+        # not change, but the stage peak does
+        with track_stage('small'):
+            _hold_memory(100, 0.2)
+    finally:
+        configure_instrumentation()
+
+    large, small = [json.loads(line) for line in stages_log.read_text().splitlines()]
+    assert large['stage_rss_growth_mb'] > 300
+    assert 80 < small['stage_rss_growth_mb'] < 300
+    assert small['stage_peak_rss_mb'] <= small['peak_rss_mb']
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import generate_pred_data, generate_stop_from_repo
+from mostra.preprocessing import CASE_KEYS, SINGLE_CASE_SECONDS_THRESHOLD, aggregate_schedule_items
+
+
+def aggregate_schedule_items_loop(df: pd.DataFrame) -> pd.DataFrame:
+    """ Previous implementation of aggregate_schedule_items (reference) """
+    df['forecast_time_datetime'] = pd.to_datetime(df['forecast_time'], unit='s')
+    df['request_time_datetime'] = pd.to_datetime(df['request_time'], unit='s')
+
+    final_df = []
+    route_path_ids = list(df['route_path_id'].unique())
+    route_path_ids.sort()
+    for path_id in route_path_ids:
+        route_path_df = df[df['route_path_id'] == path_id]
+
+        stops_list = list(route_path_df['stop_id'].unique())
+        for stop in stops_list:
+            stop_df = route_path_df[route_path_df['stop_id'] == stop]
+
+            for transport_id in list(stop_df['tmId'].unique()):
+                transport_df = stop_df[stop_df['tmId'] == transport_id]
+
+                transponder_data = transport_df[transport_df['byTelemetry'] == 1]
+                if len(transponder_data) > 0:
+                    transponder_data = transponder_data.drop(columns=['id'])
+
+                scheduled_data = transport_df[transport_df['byTelemetry'] == 0]
+                if len(scheduled_data) < 1:
+                    continue
+                elif len(scheduled_data) == 1:
+                    final_df.extend([transponder_data, scheduled_data])
+
+                scheduled_data = scheduled_data.sort_values(by='forecast_time')
+                row_id = 0
+                current_time_batch = 0
+                time_batches = []
+                for _, row in scheduled_data.iterrows():
+                    if row_id == 0:
+                        row_id += 1
+                        time_batches.append(current_time_batch)
+                        continue
+
+                    prev_row = scheduled_data.iloc[row_id - 1]
+                    time_diff = row.forecast_time - prev_row.forecast_time
+                    if time_diff >= SINGLE_CASE_SECONDS_THRESHOLD:
+                        current_time_batch += 1
+                    time_batches.append(current_time_batch)
+                    row_id += 1
+
+                scheduled_data['case'] = time_batches
+                scheduled_data = scheduled_data.groupby('case').agg({'stop_id': 'first',
+                                                                     'route_path_id': 'first',
+                                                                     'forecast_time': 'mean',
+                                                                     'byTelemetry': 'first',
+                                                                     'tmId': 'first',
+                                                                     'routePathId': 'first',
+                                                                     'request_time': 'mean',
+                                                                     'forecast_time_datetime': 'mean',
+                                                                     'request_time_datetime': 'mean'})
+                scheduled_data = scheduled_data.reset_index()
+                scheduled_data = scheduled_data.drop(columns=['case'])
+
+                final_df.extend([transponder_data, scheduled_data])
+    return pd.concat(final_df)
+
+
+def _sort_rows(df: pd.DataFrame) -> pd.DataFrame:
+    columns = sorted(df.columns)
+    df = df[columns].astype({'forecast_time': float, 'request_time': float})
+    return df.sort_values(by=columns, kind='mergesort').reset_index(drop=True)
+
+
+@pytest.fixture(scope='module')
+def pred_data() -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    stop_from_repo = generate_stop_from_repo(5, rng)
+    return generate_pred_data(stop_from_repo, 20000, rng)
+
+
+def test_aggregate_schedule_items_matches_loop(pred_data):
+    expected = aggregate_schedule_items_loop(pred_data.copy())
+    actual = aggregate_schedule_items(pred_data.copy())
+
+    # The loop added triples with a single scheduled item twice: the raw row
+    # (with "id") and its aggregate, together with the telemetry of the triple
+    scheduled_counts = pred_data[pred_data['byTelemetry'] == 0].groupby(CASE_KEYS).size()
+    single_keys = scheduled_counts[scheduled_counts == 1].index
+    is_single = pd.MultiIndex.from_frame(pred_data[CASE_KEYS]).isin(single_keys)
+    n_duplicates = int((is_single & (pred_data['byTelemetry'] == 1)).sum()) + len(single_keys)
+    assert len(expected) - len(actual) == n_duplicates
+
+    expected = expected.drop(columns=['id']).drop_duplicates()
+    pd.testing.assert_frame_equal(_sort_rows(expected), _sort_rows(actual), check_dtype=False)
+
+
+def test_aggregate_schedule_items_splits_cases_by_threshold():
+    base = 1658631600
+    df = pd.DataFrame({'id': range(4),
+                       'stop_id': 's', 'route_path_id': 'r',
+                       'forecast_time': [base, base + 60, base + 60 + SINGLE_CASE_SECONDS_THRESHOLD, base + 5000],
+                       'byTelemetry': 0, 'tmId': 1, 'routePathId': 'r',
+                       'request_time': [base - 300, base - 200, base, base + 4000]})
+    aggregated = aggregate_schedule_items(df)
+    assert list(aggregated['forecast_time']) == [base + 30, base + 60 + SINGLE_CASE_SECONDS_THRESHOLD, base + 5000]
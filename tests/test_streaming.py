@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import generate_pred_data, generate_stop_from_repo
+from mostra.arrival import calculate_arrival_time
+from mostra.catalog import StopCatalog
+from mostra.io import read_pred_data_csv
+from mostra.preprocessing import aggregate_schedule_items
+from mostra.streaming import estimate_chunk_size, process_pred_data_by_routes
+
+MEMORY_BUDGET_MB = 0.5
+
+
+def _sort_rows(df: pd.DataFrame) -> pd.DataFrame:
+    # Means of datetime columns can differ in nanoseconds due to float rounding
+    for column in [column for column in df.columns if column.endswith('_datetime')]:
+        df[column] = pd.to_datetime(df[column]).dt.round('ms')
+    columns = sorted(df.columns)
+    return df[columns].sort_values(by=columns, kind='mergesort').reset_index(drop=True)
+
+
+def test_streaming_gives_in_memory_result(tmp_path):
+    rng = np.random.default_rng(0)
+    stop_from_repo = generate_stop_from_repo(5, rng)
+    catalog = StopCatalog(stop_from_repo)
+    csv_path = tmp_path / 'pred_data.csv'
+    generate_pred_data(stop_from_repo, 20000, rng).to_csv(csv_path, index=False, header=False)
+    # Several chunks are read
+    assert estimate_chunk_size(csv_path, MEMORY_BUDGET_MB) < 20000 / 3
+
+    # Shards are placed next to the source file - it must not be removed
+    process_pred_data_by_routes(csv_path, MEMORY_BUDGET_MB, shards_folder=tmp_path, catalog=catalog)
+    assert csv_path.is_file()
+
+    preprocessed = aggregate_schedule_items(read_pred_data_csv(csv_path))
+    arrival = calculate_arrival_time(preprocessed, catalog, show_progress=False)
+    for expected, name in [(preprocessed, 'pred_data_preprocessed.csv'), (arrival, 'actual_vs_forecasted.csv')]:
+        # Compare tables after the same csv round trip
+        expected_path = tmp_path / f'expected_{name}'
+        expected.to_csv(expected_path, index=False)
+        pd.testing.assert_frame_equal(_sort_rows(pd.read_csv(tmp_path / name)),
+                                      _sort_rows(pd.read_csv(expected_path)))
+
+
+def test_previous_outputs_are_removed(tmp_path):
+    rng = np.random.default_rng(0)
+    catalog = StopCatalog(generate_stop_from_repo(5, rng))
+    csv_path = tmp_path / 'pred_data.csv'
+    csv_path.write_text('')
+    for name in ['pred_data_preprocessed.csv', 'actual_vs_forecasted.csv']:
+        (tmp_path / name).write_text('stale\n')
+
+    process_pred_data_by_routes(csv_path, MEMORY_BUDGET_MB, catalog=catalog)
+    assert not (tmp_path / 'pred_data_preprocessed.csv').exists()
+    assert not (tmp_path / 'actual_vs_forecasted.csv').exists()